@@ -0,0 +1,128 @@
+"""
+Check that story navigation templates render exactly as they did when StoryInfo used wikitextparser.
+
+    python -m benchmarks.nav_equivalence [--cases 100000] [--seed 0] [--data DIR]
+
+Random sequences of set_arg calls are applied both to a NavTemplate and to a wikitextparser Template, whose output is
+then put through format_nav as StoryInfo.full_text used to do. With --data, the navigation of every scenario group in
+the corpus (see benchmarks.story_bench) is compared the same way.
+
+Half of the sequences are arbitrary calls whose values only contain balanced markup. The other half follow the order
+in which the story generators set arguments (title and summary, then the rest before title) with any value at all.
+wikitextparser parses values as wikitext, so a stray | or }} in an argument that is set again afterwards or an
+unbalanced [[ changes which arguments it sees; nav values never have those.
+Sequences that make wikitextparser raise are skipped.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from wikitextparser import Template
+
+nav_arg_names = ["title", "summary", "next_title", "next_page", "prev_title", "prev_page"]
+balanced_parts = list("ab =\n'") + ["  ", "[x]", "[[a]]", "[[a|b]]", "{{x|y}}"]
+any_parts = balanced_parts + ["|", " |", "{", "}", "}}", "[", "]"]
+
+
+def reference_render(name: str, ops: list[tuple[str, str, str | None]]) -> str | None:
+    from story.story_utils import format_nav
+    template = Template("{{" + name + "}}")
+    try:
+        for k, v, before in ops:
+            template.set_arg(k, v, before=before)
+    except AttributeError:
+        return None
+    return format_nav(str(template))
+
+
+def render(name: str, ops: list[tuple[str, str, str | None]]) -> str:
+    from story.story_utils import NavTemplate
+    template = NavTemplate(name)
+    for k, v, before in ops:
+        template.set_arg(k, v, before=before)
+    return template.render()
+
+
+def random_ops(rng: random.Random, like_generators: bool) -> list[tuple[str, str, str | None]]:
+    parts = any_parts if like_generators else balanced_parts
+
+    def value() -> str:
+        return "".join(rng.choice(parts) for _ in range(rng.randint(0, 6)))
+
+    # make_story_text always sets these two first
+    ops = [("title", value(), None), ("summary", value(), None)]
+    if like_generators:
+        for k in rng.sample(nav_arg_names[2:], rng.randint(0, 4)):
+            ops.append((k, value(), "title"))
+    else:
+        for _ in range(rng.randint(0, 6)):
+            ops.append((rng.choice(nav_arg_names), value(), rng.choice([None, "title", "summary"])))
+    return ops
+
+
+def check_random(cases: int, seed: int) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    checked = 0
+    for case in range(cases):
+        ops = random_ops(rng, case % 2 == 1)
+        expected = reference_render("Story/StoryTop", ops)
+        if expected is None:
+            continue
+        checked += 1
+        actual = render("Story/StoryTop", ops)
+        if actual != expected:
+            failures += 1
+            if failures <= 5:
+                print(f"Mismatch for {ops}:\n  expected {expected!r}\n  actual   {actual!r}")
+    print(f"{checked} random sequences checked, {failures} mismatches")
+    return failures
+
+
+def check_stories(data: Path) -> int:
+    import json
+    import utils
+    from story.story_parser import render_stories, StorySpec
+    from story.story_utils import get_events, make_story_list_nav, scenario_pattern, StoryType
+
+    utils.music_dict.update((int(k), v) for k, v in json.load(open("music.json", "r", encoding="utf-8")).items())
+    specs = [StorySpec(group_id, StoryType.MAIN) for group_id in sorted(get_events(scenario_pattern))]
+    stories = [story for story in render_stories(specs) if story is not None]
+    make_story_list_nav(stories, "Story/")
+    failures = 0
+    for story in stories:
+        for nav in [story.nav_top, story.nav_bottom]:
+            ops = [(k, v, None) for k, v in nav.args.items()]
+            if nav.render() != reference_render(nav.name, ops):
+                failures += 1
+                print(f"Mismatch for {story.title}: {nav.render()!r}")
+    print(f"{len(stories)} stories from {data} checked, {failures} mismatches")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", type=Path, default=None)
+    args = parser.parse_args()
+
+    failures = check_random(args.cases, args.seed)
+    if args.data is not None:
+        repo_root = Path(__file__).parent.parent.absolute()
+        with tempfile.TemporaryDirectory() as work:
+            shutil.copytree(args.data, work, dirs_exist_ok=True)
+            os.chdir(work)
+            sys.path.insert(0, str(repo_root))
+            failures += check_stories(args.data)
+            os.chdir(repo_root)
+    if failures > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
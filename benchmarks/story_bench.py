@@ -0,0 +1,192 @@
+"""
+Benchmarks for the story parsing and rendering hot path.
+
+Run from the repository root:
+
+    python -m benchmarks.story_bench [--data DIR] [--output results.json] [--compare baseline.json]
+
+DIR defaults to the anonymised fixture in benchmarks/fixture and must contain json/ and cache/sprites.json like the
+working directory of a real run. It is copied to a temporary directory first, so snapshots and indexes built during
+the run do not end up in it.
+
+To check a change for regressions, save the results of a run before the change and pass them to --compare after it.
+The exit status is 1 if any stage lost more than --threshold of its throughput.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout, redirect_stderr
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable
+
+fixture_path = Path(__file__).parent / "fixture"
+
+
+@dataclass
+class StageResult:
+    stage: str
+    unit: str
+    items: int
+    seconds: float
+    items_per_second: float
+    peak_kib: float
+    allocated_blocks: int
+
+
+def time_loops(run: Callable[[], None], setup: Callable[[], None], loops: int) -> float:
+    total = 0.0
+    for _ in range(loops):
+        setup()
+        start = time.perf_counter()
+        run()
+        total += time.perf_counter() - start
+    return total
+
+
+def measure(stage: str, unit: str, items: int, run: Callable[[], None], setup: Callable[[], None] = lambda: None,
+            repeat: int = 5, min_time: float = 0.2) -> StageResult:
+    """
+    Best per-run time over several rounds, then one extra run under tracemalloc for the memory figures. Each round
+    loops the stage until it takes at least min_time, as the fixture is small enough for single runs to be noise.
+    """
+    # the parser reports unknown speakers and backgrounds with print, which would otherwise dominate the timings
+    with redirect_stdout(io.StringIO()) as log, redirect_stderr(log):
+        loops = 1
+        while (elapsed := time_loops(run, setup, loops)) < min_time:
+            loops = max(loops * 2, int(loops * min_time / elapsed) + 1) if elapsed > 0 else loops * 10
+        best = elapsed / loops
+        for _ in range(repeat):
+            gc.collect()
+            best = min(best, time_loops(run, setup, loops) / loops)
+            log.seek(0)
+            log.truncate()
+        setup()
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks() - blocks
+    return StageResult(stage, unit, items, best, items / best if best > 0 else 0.0, peak / 1024, blocks)
+
+
+def run_benchmarks(repeat: int, min_time: float) -> list[StageResult]:
+    import utils
+    from story.story_parser import parse_story, process_special_effects, tokenize_script, event_list_to_template
+    from story.story_utils import get_events, get_scenario_character_id, parse_speaker_line, find_speaker, \
+        StoryType, StoryInfo, scenario_pattern
+
+    utils.music_dict.update((int(k), v) for k, v in json.load(open("music.json", "r", encoding="utf-8")).items())
+    stories = list(get_events(scenario_pattern, workers=1).values())
+    lines = [line for story in stories for line in story]
+
+    def parse_all() -> list[list]:
+        return [list(parse_story(story, StoryType.MAIN).intermediate_text) for story in stories]
+
+    # Warm up the lookup tables so that the stages below only measure their own work
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        parsed = parse_all()
+    event_count = sum(len(events) for events in parsed)
+    texts = [event_list_to_template(events) for events in parsed]
+
+    def clear_speaker_caches():
+        parse_speaker_line.cache_clear()
+        find_speaker.cache_clear()
+
+    def special_effects():
+        for line in lines:
+            process_special_effects(tokenize_script(line.script_kr.lower()), [])
+
+    def speakers():
+        for line in lines:
+            get_scenario_character_id(line.script_kr)
+
+    def templates():
+        for events in parsed:
+            event_list_to_template(events)
+
+    def full_text():
+        for text in texts:
+            story = StoryInfo(title="Title", summary="Summary", main_text=text, category="", chars={})
+            story.add_nav_arg("title", story.title, top_only=True)
+            story.add_nav_arg("summary", story.summary, top_only=True)
+            story.add_nav_arg("next_page", "Next", before="title")
+            _ = story.full_text
+
+    return [
+        measure("parse_story", "lines", len(lines), parse_all, repeat=repeat, min_time=min_time),
+        measure("process_special_effects", "lines", len(lines), special_effects, repeat=repeat, min_time=min_time),
+        measure("get_scenario_character_id", "lines", len(lines), speakers, setup=clear_speaker_caches,
+                repeat=repeat, min_time=min_time),
+        measure("event_list_to_template", "events", event_count, templates, repeat=repeat, min_time=min_time),
+        measure("StoryInfo.full_text", "stories", len(texts), full_text, repeat=repeat, min_time=min_time),
+    ]
+
+
+def compare(results: list[StageResult], baseline_path: Path, threshold: float) -> list[str]:
+    baseline = dict((r['stage'], r) for r in json.load(open(baseline_path, "r", encoding="utf-8"))['results'])
+    regressions = []
+    for result in results:
+        if result.stage not in baseline:
+            continue
+        before = baseline[result.stage]['items_per_second']
+        change = result.items_per_second / before - 1 if before > 0 else 0.0
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(result.stage)
+        print(f"{result.stage:<28}{before:>14.0f}{result.items_per_second:>14.0f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", type=Path, default=fixture_path)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timing round")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--compare", type=Path, default=None, help="baseline results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="throughput drop that counts as a regression")
+    args = parser.parse_args()
+
+    output = args.output.absolute()
+    baseline = args.compare.absolute() if args.compare is not None else None
+    repo_root = Path(__file__).parent.parent.absolute()
+    with tempfile.TemporaryDirectory() as work:
+        shutil.copytree(args.data, work, dirs_exist_ok=True)
+        os.chdir(work)
+        sys.path.insert(0, str(repo_root))
+        # story results must not come from a previous build
+        os.environ["BA_STORY_CACHE"] = "0"
+        # utils connects to the wiki on import; an empty offline wiki keeps the run deterministic and off the network
+        os.environ.setdefault("BA_OFFLINE_WIKI", str(Path(work) / "wiki"))
+        results = run_benchmarks(args.repeat, args.min_time)
+        os.chdir(repo_root)
+
+    for result in results:
+        print(f"{result.stage:<28}{result.items_per_second:>12.0f} {result.unit}/s"
+              f"{result.peak_kib:>12.1f} KiB peak{result.allocated_blocks:>10} blocks")
+    json.dump({
+        "python": sys.version,
+        "data": str(args.data),
+        "results": [asdict(r) for r in results],
+    }, open(output, "w", encoding="utf-8"), indent=4)
+
+    if baseline is not None:
+        print()
+        print(f"{'stage':<28}{'baseline/s':>14}{'current/s':>14}{'change':>9}")
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
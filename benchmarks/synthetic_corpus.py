@@ -0,0 +1,431 @@
+"""
+Generate a synthetic version of the game tables that the bot reads, for running the pipeline offline at a multiple of
+today's data volume.
+
+    python -m benchmarks.synthetic_corpus OUT [--scale 5] [--seed 0]
+
+OUT receives json/ with the scenario, MomoTalk, relationship, localisation, BGM, background, speaker and campaign
+tables, cache/sprites.json, music.json for benchmarks.story_bench, and wiki/, an offline wiki (see offline_wiki.py)
+with a page in Category:Characters for every student and the Music page. Run the generators from OUT (or OUT/scripts
+for scripts/missions.py) with the repository on PYTHONPATH and --offline-wiki OUT/wiki, so that nothing is fetched from
+or saved to the real wiki. At --scale 1 the volumes are roughly those of the live game; the numbers scale linearly.
+
+Command, speaker and BGM frequencies follow a handful of real stories: most rows are dialogue, a few students do most
+of the talking and a few themes cover most of the music.
+"""
+import argparse
+import json
+import random
+from dataclasses import dataclass, field
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterable
+
+from xxhash import xxh32
+
+from offline_wiki import Site, Page
+
+hangul_syllables = "가나다라마바사아자차카타파하거너더러머버서어저처고노도로모보소오조초구누두루무부수우주추기니디리미비시이지치"
+words = ("teacher", "school", "today", "really", "we", "should", "go", "the", "club", "is", "a", "little", "strange",
+         "but", "I", "think", "it", "will", "be", "fine", "where", "are", "you", "going", "with", "that", "bag",
+         "please", "wait", "for", "me", "mission", "report", "again", "tomorrow", "everyone", "help", "us", "now")
+faces = [f"{i:02d}" for i in range(25)]
+clubs = [f"Club{i:02d}" for i in range(16)]
+sounds = ["SE_Door_Open_01", "SE_FootStep_02", "SE_Phone_Ring", "SFX_Explosion_03", "SE_Cheer_01", "SE_Paper_01"]
+item_ids = [1, 3, 10, 11]
+
+
+def zipf_weights(n: int, exponent: float = 1.1) -> list[float]:
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def write_table(path: Path, rows: Iterable[dict]):
+    """Write rows the way the dumped tables are laid out, without holding the whole table in memory."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"DataList": [')
+        for index, row in enumerate(rows):
+            if index > 0:
+                f.write(",\n")
+            f.write(json.dumps(row, ensure_ascii=False))
+        f.write("]}")
+
+
+@dataclass
+class Speaker:
+    name_ko: str
+    name: str
+    nickname: str
+    dev_name: str = ""
+    character_id: int = 0
+
+
+@dataclass
+class Corpus:
+    rng: random.Random
+    scale: float
+    speakers: list[Speaker] = field(default_factory=list)
+    students: list[Speaker] = field(default_factory=list)
+    speaker_weights: list[float] = field(default_factory=list)
+    bgm_ids: list[int] = field(default_factory=list)
+    bgm_weights: list[float] = field(default_factory=list)
+    background_ids: list[int] = field(default_factory=list)
+    localize: list[dict] = field(default_factory=list)
+    next_group_id: int = 1000000
+
+    def count(self, base: int) -> int:
+        return max(1, round(base * self.scale))
+
+    def korean(self, length: int) -> str:
+        return "".join(self.rng.choice(hangul_syllables) for _ in range(length))
+
+    def sentence(self) -> str:
+        text = " ".join(self.rng.choice(words) for _ in range(self.rng.randint(3, 14)))
+        return text[0].upper() + text[1:] + self.rng.choice([".", ".", ".", "!", "?", "..."])
+
+    def speaker(self) -> Speaker:
+        return self.rng.choices(self.speakers, cum_weights=self.speaker_weights)[0]
+
+    def bgm(self) -> int:
+        return self.rng.choices(self.bgm_ids, cum_weights=self.bgm_weights)[0]
+
+    def group_id(self) -> int:
+        self.next_group_id += 10
+        return self.next_group_id
+
+    def add_digest(self, group_id: int):
+        for key, text in [(f"ScenarioDigest_Title_{group_id}", f"Story {group_id}"),
+                          (f"ScenarioDigest_Description_{group_id}", self.sentence())]:
+            self.localize.append({"Key": xxh32(key).intdigest(), "Kr": self.korean(8), "Jp": "", "En": text})
+
+
+def make_speakers(corpus: Corpus, out: Path):
+    rng = corpus.rng
+    used: set[str] = set()
+
+    def unique_korean() -> str:
+        while (name := corpus.korean(rng.randint(2, 4))) in used:
+            pass
+        used.add(name)
+        return name
+
+    for i in range(corpus.count(220)):
+        student = Speaker(unique_korean(), f"Student{i:04d}", rng.choice(clubs), f"ST{i:04d}", 10000 + i)
+        corpus.students.append(student)
+    mobs = [Speaker(unique_korean(), f"Extra{i:04d}", "") for i in range(corpus.count(120))]
+    corpus.speakers = corpus.students + mobs
+    rng.shuffle(corpus.speakers)
+    corpus.speaker_weights = zipf_weights(len(corpus.speakers))
+
+    rows = []
+    for speaker in corpus.speakers:
+        spine = f"UIs/03_Scenario/02_Character/CharacterSpine_{speaker.dev_name}" if speaker.dev_name else ""
+        portrait = f"UIs/01_Common/01_Character/Student_Portrait_{speaker.dev_name}" if speaker.dev_name else ""
+        rows.append({"CharacterName": xxh32(speaker.name_ko).intdigest(), "ProductionStep": "Release",
+                     "NameKR": speaker.name_ko, "NicknameKR": "", "NameJP": "", "NicknameJP": "",
+                     "NameEN": speaker.name, "NicknameEN": speaker.nickname, "Shape": "Signal",
+                     "SpinePrefabName": spine, "SmallPortrait": portrait})
+    write_table(out / "json/ScenarioCharacterNameExcelTable.json", rows)
+
+    json.dump(dict((s.dev_name, {"firstname": s.name, "variant": None}) for s in corpus.students),
+              open(out / "json/devname_map.json", "w", encoding="utf-8"), indent=2)
+    json.dump({}, open(out / "json/devname_map_aux.json", "w", encoding="utf-8"))
+    sprites = dict((s.name, sorted(rng.sample(faces, rng.randint(4, 20)))) for s in corpus.students)
+    json.dump(sprites, open(out / "cache/sprites.json", "w", encoding="utf-8"), indent=2)
+
+
+def make_media(corpus: Corpus, out: Path):
+    rng = corpus.rng
+    corpus.bgm_ids = list(range(1, corpus.count(160) + 1))
+    rng.shuffle(corpus.bgm_ids)
+    corpus.bgm_weights = zipf_weights(len(corpus.bgm_ids), 0.9)
+    bgm_rows = []
+    for bgm_id in sorted(corpus.bgm_ids):
+        looped = rng.random() < 0.7
+        bgm_rows.append({"Id": bgm_id, "Path": [f"Audio/BGM/Theme_{bgm_id:03d}"],
+                         "LoopStartTime": [round(rng.uniform(0, 20), 2)] if looped else [],
+                         "LoopEndTime": [round(rng.uniform(60, 180), 2)] if looped else [],
+                         "Volume": [rng.choice([0.6, 0.8, 1.0])], "LoopTranstionTime": [0.5], "LoopOffsetTime": [0.0]})
+    write_table(out / "json/BGMExcelTable.json", bgm_rows)
+    json.dump(dict((str(bgm_id), f"Theme {bgm_id}") for bgm_id in corpus.bgm_ids),
+              open(out / "music.json", "w", encoding="utf-8"))
+
+    corpus.background_ids = list(range(1, corpus.count(450) + 1))
+    backgrounds = []
+    for bg_id in corpus.background_ids:
+        if rng.random() < 0.1:
+            student = rng.choice(corpus.students)
+            name = f"UIs/03_Scenario/01_Background/SpineBG_Lobby_{student.dev_name}"
+        else:
+            name = f"UIs/03_Scenario/01_Background/BG_Place{bg_id:04d}"
+        backgrounds.append({"Name": bg_id, "ProductionStep": "Release", "BGFileName": name, "BGType": "Image",
+                            "AnimationRoot": "", "AnimationName": "", "SpineScale": 0, "SpineLocalPosX": 0,
+                            "SpineLocalPosY": 0})
+    write_table(out / "json/ScenarioBGNameExcelTable.json", backgrounds)
+
+
+def script_row(group_id: int, script_kr: str, text_en: str, **kwargs) -> dict:
+    row = {"GroupId": group_id, "SelectionGroup": 0, "BGMId": 0, "Sound": "", "Transition": 0, "BGName": 0,
+           "BGEffect": 0, "PopupFileName": "", "ScriptKr": script_kr, "TextJp": "", "TextTh": "", "TextTw": "",
+           "TextEn": text_en, "VoiceId": []}
+    row.update(kwargs)
+    return row
+
+
+def make_dialogue(corpus: Corpus, group_id: int) -> list[dict]:
+    """One script row or, for choices, a few, drawn from the command mix of real stories."""
+    rng = corpus.rng
+    kind = rng.choices(["speaker", "two", "narration", "na", "wait", "st", "zmc", "hide", "clear", "shake", "font",
+                        "action", "plain", "choice"],
+                       weights=[38, 8, 10, 5, 5, 5, 2, 3, 2, 1, 1, 6, 12, 2])[0]
+    speaker = corpus.speaker()
+    line = f"3;{speaker.name_ko};{rng.choice(faces)};{corpus.korean(6)}"
+    if kind == "speaker":
+        return [script_row(group_id, line, corpus.sentence())]
+    if kind == "two":
+        return [script_row(group_id, f"2;{corpus.speaker().name_ko};{rng.choice(faces)}\n{line}", corpus.sentence())]
+    if kind == "narration":
+        return [script_row(group_id, f"[ns]{corpus.korean(10)}", f"[ns]{corpus.sentence()}")]
+    if kind == "na":
+        return [script_row(group_id, f"#na;{corpus.korean(10)}", corpus.sentence())]
+    if kind == "wait":
+        return [script_row(group_id, f"#wait;{rng.choice([500, 1000, 1500, 2000])}", "")]
+    if kind == "st":
+        return [script_row(group_id, f"#st;[{rng.randint(-1200, 0)},{rng.randint(-600, 0)}];serial;32;",
+                           f"[log={speaker.name_ko}]{corpus.sentence()}[/log]")]
+    if kind == "zmc":
+        return [script_row(group_id, f"#zmc;instant;0,-100;1500;0\n{line}", corpus.sentence())]
+    if kind == "hide":
+        return [script_row(group_id, "#all;hide", "")]
+    if kind == "clear":
+        return [script_row(group_id, "#clearst", "")]
+    if kind == "shake":
+        return [script_row(group_id, f"#bgshake\n{line}", corpus.sentence())]
+    if kind == "font":
+        return [script_row(group_id, f"#fontsize;{rng.choice([80, 100, 120])}\n{line}", corpus.sentence())]
+    if kind == "action":
+        action = rng.choice(["closeup", "hide", "em;[땀]", "jump", "shake", "stiff", "d", "dr"])
+        return [script_row(group_id, f"#{rng.randint(1, 5)};{action}\n{line}", corpus.sentence())]
+    if kind == "plain":
+        return [script_row(group_id, "", corpus.sentence())]
+    options = rng.randint(2, 3)
+    rows = [script_row(group_id, "".join(f"[s{i}]{corpus.korean(4)}" for i in range(1, options + 1)),
+                       "".join(f"[s{i}]{corpus.sentence()}" for i in range(1, options + 1)))]
+    for i in range(1, options + 1):
+        for _ in range(rng.randint(1, 2)):
+            rows.append(script_row(group_id, line, corpus.sentence(), SelectionGroup=group_id * 10 + i))
+    return rows
+
+
+def make_story(corpus: Corpus, group_id: int) -> list[dict]:
+    rng = corpus.rng
+    corpus.add_digest(group_id)
+    rows = [script_row(group_id, f"#title;{corpus.korean(4)};{corpus.korean(6)}",
+                       f"Episode {group_id % 20};{corpus.sentence()}",
+                       BGMId=corpus.bgm(), BGName=rng.choice(corpus.background_ids))]
+    if rng.random() < 0.3:
+        rows.append(script_row(group_id, f"#place;{corpus.korean(5)}", corpus.sentence()))
+    for _ in range(max(5, round(rng.lognormvariate(4.6, 0.5)))):
+        extra = {}
+        if rng.random() < 0.03:
+            extra["BGMId"] = corpus.bgm()
+        if rng.random() < 0.03:
+            extra["BGName"] = rng.choice(corpus.background_ids)
+        if rng.random() < 0.04:
+            extra["Sound"] = rng.choice(sounds)
+        if rng.random() < 0.01:
+            extra["PopupFileName"] = f"popup_{rng.randint(1, 400):03d}"
+        dialogue = make_dialogue(corpus, group_id)
+        dialogue[0].update(extra)
+        rows.extend(dialogue)
+    if rng.random() < 0.1:
+        rows.append(script_row(group_id, f"#nextepisode;{corpus.korean(3)};{corpus.korean(5)}",
+                               f"Episode {group_id % 20 + 1};{corpus.sentence()}"))
+    elif rng.random() < 0.1:
+        rows.append(script_row(group_id, "#continued", ""))
+    return rows
+
+
+def make_scenarios(corpus: Corpus, out: Path, shards: int = 9) -> tuple[list[dict], list[dict], list[dict]]:
+    """Write the scenario shards and return the ScenarioMode, EventContentScenario and favor schedule rows."""
+    rng = corpus.rng
+    modes = []
+    mode_id = 0
+
+    def add_mode(mode_type: str, volume: int, chapter: int, episode: int, club: str = "None") -> list[int]:
+        nonlocal mode_id
+        mode_id += 1
+        front = [corpus.group_id()]
+        back = [corpus.group_id()] if rng.random() < 0.4 else []
+        modes.append({"ModeId": mode_id, "ModeType": mode_type, "SubType": "None", "VolumeId": volume,
+                      "ChapterId": chapter, "EpisodeId": episode, "FrontScenarioGroupId": front,
+                      "BackScenarioGroupId": back, "NeedClub": club, "NeedClubStudentCount": 0})
+        return front + back
+
+    group_ids: list[int] = []
+    for volume in range(1, 6):
+        for chapter in range(1, 5):
+            for episode in range(1, corpus.count(7) + 1):
+                group_ids.extend(add_mode("Main", volume, chapter, episode))
+    for episode in range(1, corpus.count(10) + 1):
+        group_ids.extend(add_mode("SpecialOperation", 0, 0, episode))
+    for volume, club in enumerate(clubs, 1):
+        for episode in range(1, corpus.count(5) + 1):
+            group_ids.extend(add_mode("Sub", volume, 0, episode, club))
+
+    events = []
+    for event_content_id in range(801, 801 + corpus.count(60)):
+        for _ in range(rng.randint(6, 12)):
+            group_id = corpus.group_id()
+            group_ids.append(group_id)
+            events.append({"EventContentId": event_content_id, "ScenarioGroupId": [group_id], "IsMeetup": False,
+                           "Order": len(events)})
+            # a battle between two parts of the same episode, see load_event_stories
+            if rng.random() < 0.1:
+                group_ids.append(group_id + 5)
+                events.append({"EventContentId": event_content_id, "ScenarioGroupId": [group_id + 5],
+                               "IsMeetup": False, "Order": len(events)})
+        if rng.random() < 0.1:
+            group_id = corpus.group_id()
+            group_ids.append(group_id)
+            events.append({"EventContentId": event_content_id, "ScenarioGroupId": [group_id], "IsMeetup": True,
+                           "Order": len(events)})
+
+    favor_schedule = []
+    for student in corpus.students:
+        for order, favor_rank in enumerate(sorted(rng.sample(range(2, 21), rng.randint(4, 5))), 1):
+            group_id = corpus.group_id()
+            group_ids.append(group_id)
+            favor_schedule.append({"Id": len(favor_schedule) + 1, "CharacterId": student.character_id,
+                                   "ScenarioSriptGroupId": [group_id], "OrderInGroup": order,
+                                   "FavorRank": favor_rank, "RewardParcelType": ["Currency"],
+                                   "RewardParcelId": [3], "RewardAmount": [40]})
+
+    files = [open(out / f"json/ScenarioScriptExcelTable{i}.json", "w", encoding="utf-8") for i in range(1, shards + 1)]
+    first = [True] * shards
+    for f in files:
+        f.write('{"DataList": [')
+    for group_id in group_ids:
+        shard = group_id // 10 % shards
+        for row in make_story(corpus, group_id):
+            if not first[shard]:
+                files[shard].write(",\n")
+            first[shard] = False
+            files[shard].write(json.dumps(row, ensure_ascii=False))
+    for f in files:
+        f.write("]}")
+        f.close()
+    return modes, events, favor_schedule
+
+
+def make_momotalk(corpus: Corpus, favor_schedule: list[dict]) -> Iterable[dict]:
+    """
+    One conversation per favor schedule row. Each one may branch once on Sensei's reply and converges again before
+    the line that unlocks the relationship story, which is the shape make_conversation expects.
+    """
+    rng = corpus.rng
+    message_id = 0
+    group_id = 0
+
+    def message(student: Speaker, group: int, condition: str = "None", next_group: int = 0, schedule: int = 0,
+                image: bool = False) -> dict:
+        nonlocal message_id
+        message_id += 1
+        return {"Id": message_id, "CharacterId": student.character_id, "MessageGroupId": group,
+                "MessageCondition": condition, "ConditionValue": 0, "PreConditionGroupId": 0,
+                "PreConditionFavorScheduleId": 0, "FavorScheduleId": schedule, "NextGroupId": next_group,
+                "FeedbackTimeMillisec": 0, "MessageType": "Image" if image else "Text",
+                "ImagePath": f"UIs/01_Common/31_MomoTalk/MomoTalk_{message_id}" if image else "",
+                "MessageKR": corpus.korean(8), "MessageEN": "" if image else corpus.sentence()}
+
+    students = dict((s.character_id, s) for s in corpus.students)
+    for schedule in favor_schedule:
+        student = students[schedule['CharacterId']]
+        group_id += 1
+        opening = group_id
+        for index in range(rng.randint(1, 3)):
+            yield message(student, opening, "FavorRankUp" if index == 0 else "None", opening + 1,
+                          image=index > 0 and rng.random() < 0.1)
+        group_id += 1
+        answer = group_id
+        options = rng.choice([1, 1, 2, 3])
+        group_id += options
+        converge = group_id + 1
+        for option in range(options):
+            reply = answer + option + 1 if options > 1 else converge
+            yield message(student, answer, "Answer", reply)
+        if options > 1:
+            for option in range(options):
+                yield message(student, answer + option + 1, next_group=converge)
+        group_id = converge
+        for index in range(rng.randint(1, 3)):
+            yield message(student, converge)
+        yield message(student, converge, schedule=schedule['Id'])
+
+
+def make_campaign(corpus: Corpus, out: Path):
+    stages, rewards, missions = [], [], []
+    for chapter in range(1, corpus.count(25) + 1):
+        for hard in [False, True]:
+            for number in range(1, 6 if not hard else 4):
+                stage_id = 1000000 + chapter * 1000 + hard * 100 + number
+                kind = "Hard_Main_Stage" if hard else "Normal_Main_Stage"
+                stages.append({"Id": stage_id, "Name": f"CHAPTER{chapter:02d}_{kind}_{number:02d}",
+                               "StageNumber": str(number), "StarConditionTacticRankSCount": 1,
+                               "StarConditionTurnCount": corpus.rng.randint(5, 12)})
+                rewards.append({"GroupId": stage_id, "RewardTag": "ThreeStar", "StageRewardParcelType": "Currency",
+                                "StageRewardId": 3, "StageRewardAmount": 20 if hard else 10, "StageRewardProb": 10000})
+                rewards.append({"GroupId": stage_id, "RewardTag": "Default", "StageRewardParcelType": "Currency",
+                                "StageRewardId": 1, "StageRewardAmount": 5000, "StageRewardProb": 10000})
+                parcels = corpus.rng.sample(item_ids, 2)
+                missions.append({"Id": len(missions) + 1, "Category": "Challenge",
+                                 "Description": "Mission_Complete_Campaign_Stage_Minimum_Turn",
+                                 "ChallengeStageShortcut": stage_id,
+                                 "CompleteConditionCount": corpus.rng.randint(3, 8),
+                                 "MissionRewardParcelId": parcels, "MissionRewardAmount": [20, 1]})
+    write_table(out / "json/CampaignStageExcelTable.json", stages)
+    write_table(out / "json/CampaignStageRewardExcelTable.json", rewards)
+    write_table(out / "json/MissionExcelTable.json", missions)
+
+
+def make_wiki(corpus: Corpus, out: Path):
+    """The pages that the character table and the BGM names are read from."""
+    site = Site(out / "wiki")
+    for student in corpus.students:
+        text = (f"{{{{Character\n|Id = {student.character_id}\n|Name = {student.name}\n}}}}\n"
+                f"==Profile==\n{corpus.sentence()}\n[[Category:Characters]]")
+        site.write_revision(Page(site, student.name), text, "synthetic corpus")
+    tracks = [f"{{{{Track|Id={bgm_id}|Title=Theme {bgm_id}}}}}" for bgm_id in sorted(corpus.bgm_ids)]
+    site.write_revision(Page(site, "Music"), "\n".join(tracks), "synthetic corpus")
+
+
+def generate(out: Path, scale: float = 1.0, seed: int = 0):
+    (out / "json").mkdir(parents=True, exist_ok=True)
+    (out / "cache").mkdir(exist_ok=True)
+    corpus = Corpus(random.Random(seed), scale)
+    make_speakers(corpus, out)
+    make_media(corpus, out)
+    modes, events, favor_schedule = make_scenarios(corpus, out)
+    write_table(out / "json/ScenarioModeExcelTable.json", modes)
+    write_table(out / "json/EventContentScenarioExcelTable.json", events)
+    write_table(out / "json/AcademyFavorScheduleExcelTable.json", favor_schedule)
+    write_table(out / "json/AcademyMessangerExcelTable.json", make_momotalk(corpus, favor_schedule))
+    make_campaign(corpus, out)
+    # strings that no story looks up, in about the proportion of the real table
+    for i in range(len(corpus.localize) * 4):
+        corpus.localize.append({"Key": xxh32(f"UI_Synthetic_{i}").intdigest(), "Kr": corpus.korean(6), "Jp": "",
+                                "En": corpus.sentence()})
+    write_table(out / "json/LocalizeExcelTable.json", corpus.localize)
+    make_wiki(corpus, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out", type=Path)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiple of the live data volume")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out, args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
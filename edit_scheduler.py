@@ -0,0 +1,217 @@
+"""
+One queue for the edits of every generator, saved by a background thread so that pages are fetched and compared while
+earlier edits are still being saved.
+
+Edits are saved in priority order (new pages first, cosmetic changes last) at the bot's edit rate, which a token bucket
+enforces instead of pywikibot's put throttle: BA_EDIT_RATE edits per minute (60 / put_throttle by default, unlimited on
+the offline wiki) with bursts of up to BA_EDIT_BURST. When the wiki answers with maxlag, ratelimited or a server error
+the rate is halved, the edit is retried after a pause, and the rate recovers as edits go through again.
+"""
+import atexit
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+from pywikibot import config
+from pywikibot.exceptions import APIError, MaxlagTimeoutError, ServerError, TimeoutError
+
+from wiki import Site
+
+throttling_codes = {"maxlag", "ratelimited", "readonly"}
+max_attempts = 5
+max_pause = 300.0
+
+
+class EditPriority(IntEnum):
+    CREATE = 0
+    UPDATE = 1
+    COSMETIC = 2
+
+
+@dataclass(order=True)
+class ScheduledEdit:
+    priority: int
+    sequence: int
+    page: object = field(compare=False)
+    text: str = field(compare=False)
+    summary: str = field(compare=False)
+    minor: bool = field(compare=False)
+    future: Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+def is_throttling_error(e: BaseException) -> bool:
+    """Whether the wiki asked us to slow down, also when pywikibot wrapped the error in a PageSaveRelatedError."""
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, (MaxlagTimeoutError, ServerError, TimeoutError)):
+            return True
+        if isinstance(e, APIError) and e.code in throttling_codes:
+            return True
+        e = getattr(e, "reason", None) or e.__cause__ or e.__context__
+    return False
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        # tokens per second, 0 for no limit
+        self.target_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        # start with a single token so that a new run does not burst right after the previous one
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if self.rate == 0 and wait <= 0:
+                return
+            self.refill()
+            if wait <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep(max(wait, (1 - self.tokens) / self.rate if self.rate > 0 else 0))
+
+    def back_off(self, pause: float):
+        if self.rate > 0:
+            self.rate = max(self.rate / 2, self.target_rate / 16)
+            self.tokens = 0.0
+        self.paused_until = time.monotonic() + pause
+
+    def recover(self):
+        self.rate = min(self.target_rate, self.rate * 1.25)
+
+
+class EditScheduler:
+    def __init__(self, site=None, rate: float | None = None, burst: float | None = None):
+        if rate is None:
+            default_rate = 60 / max(config.put_throttle, 1) if hasattr(site, "throttle") else 0
+            rate = float(os.environ.get("BA_EDIT_RATE", default_rate))
+        if burst is None:
+            burst = float(os.environ.get("BA_EDIT_BURST", "3"))
+        self.bucket = TokenBucket(rate / 60, burst)
+        if site is not None and hasattr(site, "throttle"):
+            # the bucket paces the edits; pywikibot's put throttle would only add its delay on top
+            site.throttle.setDelays(writedelay=0.001)
+        self.queue: list[ScheduledEdit] = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.in_progress = 0
+        self.saved = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_depth = 0
+        # time of the first submission
+        self.started: float | None = None
+        self.worker = threading.Thread(target=self.run, name="edit-scheduler", daemon=True)
+        self.worker.start()
+
+    def submit(self, page, text: str, summary: str, minor: bool = True,
+               priority: EditPriority | None = None) -> Future:
+        """Queue page to be saved with text. The future is done once it is saved, or failed for good."""
+        if priority is None:
+            priority = EditPriority.UPDATE if page.exists() else EditPriority.CREATE
+        future = Future()
+        with self.condition:
+            if self.started is None:
+                self.started = time.monotonic()
+            heapq.heappush(self.queue, ScheduledEdit(priority, next(self.sequence), page, text, summary, minor,
+                                                     future))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.condition.notify_all()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                edit = heapq.heappop(self.queue)
+                self.in_progress += 1
+            self.bucket.acquire()
+            try:
+                self.save(edit)
+            finally:
+                with self.condition:
+                    self.in_progress -= 1
+                    self.condition.notify_all()
+
+    def save(self, edit: ScheduledEdit):
+        edit.attempts += 1
+        try:
+            edit.page.text = edit.text
+            edit.page.save(summary=edit.summary, minor=edit.minor)
+        except Exception as e:
+            if is_throttling_error(e) and edit.attempts < max_attempts:
+                pause = min(max_pause, 5.0 * 2 ** edit.attempts)
+                self.bucket.back_off(pause)
+                print(f"Edit scheduler: {type(e).__name__} while saving {edit.page.title()}, retrying in {pause:.0f} s, "
+                      f"{self.depth} edits queued")
+                with self.condition:
+                    self.retries += 1
+                    heapq.heappush(self.queue, edit)
+                return
+            self.failed += 1
+            print(f"Edit scheduler: could not save {edit.page.title()}: {e}")
+            edit.future.set_exception(e)
+            return
+        self.saved += 1
+        self.bucket.recover()
+        edit.future.set_result(edit.page)
+
+    def drain(self):
+        """Wait until every edit that was submitted is saved or has failed."""
+        with self.condition:
+            while len(self.queue) > 0 or self.in_progress > 0:
+                self.condition.wait()
+
+    def finish(self, futures: Iterable[Future]):
+        """Drain, then raise the error of the first of futures that failed, so that the run exits with an error."""
+        self.drain()
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue) + self.in_progress
+
+    def report(self) -> str:
+        minutes = (time.monotonic() - self.started) / 60 if self.started is not None else 0
+        return (f"{self.saved} saved, {self.failed} failed, {self.retries} retried, "
+                f"{self.saved / minutes if minutes > 0 else 0:.1f} edits/minute, peak queue depth {self.max_depth}")
+
+
+scheduler: EditScheduler | None = None
+scheduler_lock = threading.Lock()
+
+
+def close_scheduler():
+    if scheduler is not None:
+        scheduler.drain()
+        if scheduler.saved + scheduler.failed > 0:
+            print(f"Edit scheduler: {scheduler.report()}")
+
+
+def edit_scheduler(site=None) -> EditScheduler:
+    """The scheduler shared by everything that saves pages in this process."""
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = EditScheduler(site if site is not None else Site())
+            atexit.register(close_scheduler)
+        return scheduler
@@ -1,9 +1,9 @@
 import re
 
-from pywikibot.pagegenerators import GeneratorFactory
 import wikitextparser as wtp
 
 from utils import find_template, save_json_page
+from wiki import GeneratorFactory
 
 def update_mission_drops():
     gen = GeneratorFactory()
@@ -1,10 +1,12 @@
+from concurrent.futures import Future
+from functools import partial
 from itertools import takewhile
-import pywikibot as pwb
-from pywikibot import Page
-from pywikibot.pagegenerators import PreloadingGenerator
+from edit_scheduler import edit_scheduler
+from wiki import Site, Page, PreloadingGenerator
 import sys
 
-from utils import get_character_table, load_momotalk, load_favor_schedule
+from utils import get_character_table, load_momotalk, load_favor_schedule, find_unchanged_pages, record_revision, \
+    write_revision_cache, text_hash, journal_done, journal_record, journaled_run, finish_save, json_cache
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -181,27 +183,39 @@ def make_character_momotalk(momotalk: list[dict], char_name: str, favor_levels:
     return make_top(char_name) + "\n\n".join(result)
 
 
-s = pwb.Site()
+s = Site()
 
 
 confirm = False
 
 
-def create_momotalk_page(p: pwb.Page, student_name, text):
+def create_momotalk_page(p: Page, student_name, text) -> Future | None:
     global confirm
     if text.strip() == "":
         print(f"ERROR: text for {student_name} is empty.")
         return
+    digest = text_hash(text)
+    if journal_done(p.title(), digest):
+        return
+    journal_record("save", p.title(), digest, "planned")
     setattr(p, "_bot_may_edit", True)
+    record_revision(p)
     if text == p.text:
         # print(f"INFO: {student_name} has the same text.")
+        journal_record("save", p.title(), digest, "skipped")
         return
     if confirm:
-        x = input(f"Save {p.title()}? ")
+        # let the saves confirmed so far finish first, so that each answer comes before its own save
+        edit_scheduler(s).drain()
+        x = input(f"Save {p.title()}? [y/n/a] ")
+        if x.lower() == 'n':
+            journal_record("save", p.title(), digest, "skipped")
+            return None
         if x.lower() == 'a':
             confirm = False
-    p.text = text
-    p.save("auto-generate momotalk")
+    future = edit_scheduler(s).submit(p, text, "auto-generate momotalk")
+    future.add_done_callback(partial(finish_save, p.title(), digest))
+    return future
 
 
 def get_character_favor_schedule(char_id: int) -> list[int]:
@@ -210,28 +224,46 @@ def get_character_favor_schedule(char_id: int) -> list[int]:
 
 
 def momotalk_main():
-    char_dict = get_character_table(use_cache=False)
-    momotalk_dict = load_momotalk()
+    char_dict = get_character_table(incremental=True)
     results: list[tuple[str, str]] = []
-    for char_id, momotalk in momotalk_dict.items():
-        if char_id not in char_dict:
-            continue
-        try:
-            favor_schedule = get_character_favor_schedule(char_id)
-        except Exception as e:
-            print(char_id)
-            continue
-        char_name = char_dict[char_id]
-        char_name = char_name[0].capitalize() + char_name[1:]
-        momotalk_text = make_character_momotalk(momotalk, char_name, favor_schedule)
-        results.append((char_name, momotalk_text))
-    pages = (pwb.Page(s, f"{pair[0]}/MomoTalk") for pair in results)
-    pages = list(PreloadingGenerator(pages))
-    for index, p in enumerate(pages):
-        create_momotalk_page(p, results[index][0], results[index][1])
+    with json_cache.pinned(load_momotalk.cache_key, load_favor_schedule.cache_key):
+        momotalk_dict = load_momotalk()
+        for char_id, momotalk in momotalk_dict.items():
+            if char_id not in char_dict:
+                continue
+            try:
+                favor_schedule = get_character_favor_schedule(char_id)
+            except Exception as e:
+                print(char_id)
+                continue
+            char_name = char_dict[char_id]
+            char_name = char_name[0].capitalize() + char_name[1:]
+            momotalk_text = make_character_momotalk(momotalk, char_name, favor_schedule)
+            results.append((char_name, momotalk_text))
+    pages = [Page(s, f"{pair[0]}/MomoTalk") for pair in results]
+    # leave out the pages completed by the run being resumed
+    pending = [(p, pair) for p, pair in zip(pages, results) if not journal_done(p.title(), text_hash(pair[1]))]
+    unchanged = find_unchanged_pages([p for p, _ in pending], [pair[1] for _, pair in pending])
+    for p, (_, momotalk_text) in pending:
+        if p.title() in unchanged:
+            journal_record("save", p.title(), text_hash(momotalk_text), "skipped")
+    pending = [(p, pair) for p, pair in pending if p.title() not in unchanged]
+    list(PreloadingGenerator(p for p, _ in pending))
+    saves: list[Future] = []
+    try:
+        for p, (char_name, momotalk_text) in pending:
+            future = create_momotalk_page(p, char_name, momotalk_text)
+            if future is not None:
+                saves.append(future)
+        # the other pages are saved, and the journal lets a resumed run retry the failed ones
+        edit_scheduler(s).finish(saves)
+    finally:
+        edit_scheduler(s).drain()
+        write_revision_cache()
     print("MomoTalk done")
 
 
 
 if __name__ == "__main__":
-    momotalk_main()
+    with journaled_run("momotalk"):
+        momotalk_main()
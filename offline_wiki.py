@@ -0,0 +1,348 @@
+"""
+A stand-in for the wiki that keeps pages in a local directory, implementing the part of pywikibot's Site, Page,
+FilePage, PreloadingGenerator and GeneratorFactory that the bot uses. Select it with wiki.py.
+
+Layout of the directory:
+
+    pages/<quoted title>.json   {"title": ..., "revisions": [{"revid": ..., "summary": ..., "text": ...}, ...]}
+    files/<file name>           uploaded files
+    categories.json             optional {category: [titles]} for membership that does not come from [[Category:]]
+                                links in the page text, e.g. categories added by templates
+
+Every call that would be an API request on the real wiki (fetching a page that was not preloaded, every 50 pages of
+a preload with content, a category listing, an edit or an upload) sleeps for BA_OFFLINE_LATENCY_MS and is counted in
+Site.stats, along with the size of the page text that was sent.
+"""
+import atexit
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from itertools import batched
+from pathlib import Path
+from urllib.parse import quote
+
+from pywikibot.exceptions import UploadError
+from xxhash import xxh3_64_hexdigest
+
+from snapshots import file_lock
+
+heading_regex = re.compile(r"^=+[^=\n].*=+[ \t]*$", re.MULTILINE)
+namespaces = {"": 0, "Talk": 1, "User": 2, "File": 6, "Template": 10, "Category": 14, "Module": 828}
+category_link_regex = re.compile(r"\[\[\s*Category\s*:\s*([^]|]+)", re.IGNORECASE)
+
+
+def normalize_title(title: str) -> str:
+    title = title.replace("_", " ").strip()
+    prefix, colon, rest = title.partition(":")
+    if colon and prefix.strip().capitalize() in namespaces:
+        prefix = prefix.strip().capitalize()
+        rest = rest.strip()
+        return f"{prefix}:{rest[:1].upper()}{rest[1:]}"
+    return title[:1].upper() + title[1:]
+
+
+class Site:
+    maxlimit = 500
+    # the API returns the text of at most this many pages per request and continues with the rest
+    content_limit = 50
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+        (self.root / "pages").mkdir(parents=True, exist_ok=True)
+        (self.root / "files").mkdir(exist_ok=True)
+        self.latency = int(os.environ.get("BA_OFFLINE_LATENCY_MS", "0")) / 1000
+        self.stats: Counter[str] = Counter()
+        self.lock = threading.Lock()
+        self.category_index: dict[str, set[str]] | None = None
+
+    def __repr__(self):
+        return f"OfflineSite({self.root})"
+
+    def request(self, kind: str):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[kind] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def count_bytes(self, text: str):
+        with self.lock:
+            self.stats["content bytes"] += len(text.encode("utf-8"))
+
+    def login(self):
+        pass
+
+    def username(self) -> str:
+        return "OfflineBot"
+
+    def page_path(self, title: str) -> Path:
+        return self.root / "pages" / f"{quote(title, safe='')}.json"
+
+    def read_revisions(self, title: str) -> list[dict]:
+        path = self.page_path(title)
+        if not path.exists():
+            return []
+        return json.load(open(path, "r", encoding="utf-8"))['revisions']
+
+    def next_revid(self) -> int:
+        """A revision id no other process using the same directory has been given."""
+        path = self.root / "site.json"
+        with file_lock(path.with_suffix(".lock")):
+            state = {"last_revid": 0}
+            if path.exists():
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            state['last_revid'] += 1
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            tmp.replace(path)
+        return state['last_revid']
+
+    def write_revision(self, page: "Page", text: str, summary: str) -> bool:
+        """Store a new revision unless the text is unchanged, which MediaWiki treats as a null edit."""
+        # MediaWiki drops trailing whitespace on save
+        text = text.rstrip()
+        with self.lock:
+            revisions = self.read_revisions(page.title())
+            if len(revisions) > 0 and revisions[-1]['text'] == text:
+                return False
+            revid = self.next_revid()
+            revisions.append({"revid": revid, "summary": summary, "text": text})
+            tmp = page.page_path().with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"title": page.title(), "revisions": revisions}, f, ensure_ascii=False, indent=1)
+            tmp.replace(page.page_path())
+            if self.category_index is not None:
+                for members in self.category_index.values():
+                    members.discard(page.title())
+                for category in page_categories(text):
+                    self.category_index.setdefault(category, set()).add(page.title())
+        page.load(revisions[-1])
+        return True
+
+    def load_category_index(self) -> dict[str, set[str]]:
+        if self.category_index is None:
+            index: dict[str, set[str]] = {}
+            for path in (self.root / "pages").glob("*.json"):
+                loaded = json.load(open(path, "r", encoding="utf-8"))
+                for category in page_categories(loaded['revisions'][-1]['text']):
+                    index.setdefault(category, set()).add(loaded['title'])
+            extra_path = self.root / "categories.json"
+            if extra_path.exists():
+                for category, titles in json.load(open(extra_path, "r", encoding="utf-8")).items():
+                    index.setdefault(normalize_title(category), set()).update(normalize_title(t) for t in titles)
+            self.category_index = index
+        return self.category_index
+
+    def category_members(self, category: str) -> list[str]:
+        self.request("categorymembers")
+        return sorted(self.load_category_index().get(normalize_title(category), set()))
+
+    def preloadpages(self, pagelist: Iterable["Page"], *, groupsize: int | None = None, content: bool = True,
+                     **kwargs) -> Iterator["Page"]:
+        for batch in batched(pagelist, min(groupsize or self.maxlimit, self.maxlimit)):
+            for _ in batched(batch, self.content_limit if content else self.maxlimit):
+                self.request("preload")
+            for page in batch:
+                revisions = self.read_revisions(page.title())
+                page.load(revisions[-1] if len(revisions) > 0 else None, content=content)
+                if content and len(revisions) > 0:
+                    self.count_bytes(revisions[-1]['text'])
+                yield page
+
+    def lead_sections(self, titles: list[str]) -> dict[str, tuple[int, str]]:
+        """Title -> (latest revision id, text before the first heading), like rvsection=0."""
+        result = {}
+        for batch in batched(titles, self.content_limit):
+            self.request("preload")
+            for title in batch:
+                revisions = self.read_revisions(normalize_title(title))
+                if len(revisions) > 0:
+                    text = revisions[-1]['text']
+                    heading = heading_regex.search(text)
+                    lead = text[:heading.start()] if heading is not None else text
+                    self.count_bytes(lead)
+                    result[title] = (revisions[-1]['revid'], lead)
+        return result
+
+    def upload(self, filepage: "FilePage", source_filename: str, comment: str = "", text: str = "",
+               ignore_warnings: bool = False, **kwargs) -> bool:
+        self.request("upload")
+        source = Path(source_filename)
+        target = self.root / "files" / filepage.title(with_ns=False)
+        if not ignore_warnings:
+            if target.exists():
+                raise UploadError("exists", f"The file {filepage.title(with_ns=False)} already exists.")
+            digest = xxh3_64_hexdigest(source.read_bytes())
+            duplicates = [f.name for f in (self.root / "files").iterdir()
+                          if f.stat().st_size == source.stat().st_size and xxh3_64_hexdigest(f.read_bytes()) == digest]
+            if len(duplicates) > 0:
+                raise UploadError("duplicate", f"Uploaded file is a duplicate of {duplicates}.")
+        shutil.copyfile(source, target)
+        if not filepage.exists():
+            self.write_revision(filepage, text, comment)
+        return True
+
+    def print_stats(self):
+        if len(self.stats) == 0:
+            return
+        print(f"Offline wiki {self.root}: " + ", ".join(f"{v} {k}" for k, v in sorted(self.stats.items())))
+
+
+def page_categories(text: str) -> set[str]:
+    return set(normalize_title(match.group(1)) for match in category_link_regex.finditer(text))
+
+
+class Page:
+    def __init__(self, source: Site, title: str, ns: int = 0):
+        self.site = source
+        self._title = normalize_title(title)
+        if ns != 0 and ":" not in self._title:
+            prefix = next(k for k, v in namespaces.items() if v == ns)
+            self._title = f"{prefix}:{self._title}"
+        self._loaded = False
+        self._exists = False
+        self._revid = 0
+        self._text: str | None = None
+
+    def __repr__(self):
+        return f"Page({self._title!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Page) and other._title == self._title
+
+    def __hash__(self):
+        return hash(self._title)
+
+    def page_path(self) -> Path:
+        return self.site.page_path(self._title)
+
+    def load(self, revision: dict | None, content: bool = True):
+        self._loaded = True
+        self._exists = revision is not None
+        self._revid = revision['revid'] if revision is not None else 0
+        if content:
+            self._text = revision['text'] if revision is not None else ""
+
+    def ensure_loaded(self, content: bool = True):
+        if not self._loaded or (content and self._text is None):
+            self.site.request("read")
+            revisions = self.site.read_revisions(self._title)
+            self.load(revisions[-1] if len(revisions) > 0 else None)
+            if len(revisions) > 0:
+                self.site.count_bytes(revisions[-1]['text'])
+
+    @property
+    def namespace(self) -> int:
+        prefix, colon, _ = self._title.partition(":")
+        return namespaces.get(prefix, 0) if colon else 0
+
+    def title(self, underscore: bool = False, with_ns: bool = True, **kwargs) -> str:
+        title = self._title
+        if not with_ns and self.namespace != 0:
+            title = title.partition(":")[2]
+        return title.replace(" ", "_") if underscore else title
+
+    @property
+    def text(self) -> str:
+        self.ensure_loaded()
+        return self._text
+
+    @text.setter
+    def text(self, value: str):
+        self.ensure_loaded(content=False)
+        self._text = value
+
+    @property
+    def latest_revision_id(self) -> int:
+        self.ensure_loaded(content=False)
+        return self._revid
+
+    def exists(self) -> bool:
+        self.ensure_loaded(content=False)
+        return self._exists
+
+    def isRedirectPage(self) -> bool:
+        return re.match(r"\s*#REDIRECT", self.text, re.IGNORECASE) is not None
+
+    def save(self, summary: str = "", minor: bool = True, **kwargs):
+        self.site.request("edit")
+        self.site.write_revision(self, self._text or "", summary)
+        # like pywikibot, which reads the text again when it is next used
+        self._text = None
+
+
+class FilePage(Page):
+    def __init__(self, source: Site, title: str):
+        if not normalize_title(title).startswith("File:"):
+            title = "File:" + title
+        super().__init__(source, title)
+
+
+def PreloadingGenerator(generator: Iterable[Page], groupsize: int = 50, quiet: bool = False) -> Iterator[Page]:
+    pages = list(generator)
+    if len(pages) == 0:
+        return iter(())
+    return pages[0].site.preloadpages(pages, groupsize=groupsize)
+
+
+class GeneratorFactory:
+    """The -cat, -ns and -titleregex(not) arguments of pywikibot's GeneratorFactory."""
+
+    def __init__(self, site: Site | None = None):
+        self.site = site
+        self.categories: list[str] = []
+        self.namespaces: set[int] = set()
+        self.title_filters: list[tuple[re.Pattern, bool]] = []
+
+    def handle_args(self, args: list[str]) -> list[str]:
+        unhandled = []
+        for arg in args:
+            name, _, value = arg.partition(":")
+            if name == "-cat":
+                self.categories.append(value)
+            elif name == "-ns":
+                for ns in value.split(","):
+                    self.namespaces.add(int(ns) if ns.isnumeric() else namespaces[ns.capitalize()])
+            elif name in ("-titleregex", "-titleregexnot"):
+                self.title_filters.append((re.compile(value), name == "-titleregex"))
+            else:
+                unhandled.append(arg)
+        return unhandled
+
+    def getCombinedGenerator(self, preload: bool = False) -> Iterator[Page] | None:
+        if len(self.categories) == 0:
+            return None
+        site = self.site if self.site is not None else get_site()
+        titles: dict[str, None] = {}
+        for category in self.categories:
+            titles.update((title, None) for title in site.category_members(category))
+        pages = []
+        for title in titles:
+            page = Page(site, title)
+            if len(self.namespaces) > 0 and page.namespace not in self.namespaces:
+                continue
+            if any((regex.search(page.title()) is not None) != keep for regex, keep in self.title_filters):
+                continue
+            pages.append(page)
+        if preload:
+            return site.preloadpages(pages)
+        return iter(pages)
+
+
+sites: dict[Path, Site] = {}
+
+
+def get_site(root: Path | str | None = None) -> Site:
+    """One Site per directory, like pywikibot.Site() returns the same object for the same wiki."""
+    root = Path(root if root is not None else os.environ["BA_OFFLINE_WIKI"]).absolute()
+    if root not in sites:
+        sites[root] = Site(root)
+        atexit.register(sites[root].print_stats)
+    return sites[root]
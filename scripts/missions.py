@@ -5,6 +5,8 @@ import pywikibot as pwb
 import wikitextparser
 from pywikibot.pagegenerators import PreloadingGenerator
 
+from edit_scheduler import edit_scheduler, EditPriority
+
 
 @dataclass
 class Stage:
@@ -99,6 +101,7 @@ def propagate(stages: dict[int, Stage]):
         pages.append(page)
 
     gen = PreloadingGenerator(pages)
+    saves = []
     for page in gen:
         page: pwb.Page
         text = page.text
@@ -115,8 +118,9 @@ def propagate(stages: dict[int, Stage]):
             print("Cannot find drops on " + page.title())
         s.contents = s.contents + "\n==Objectives==\n" + str(template) + "\n\n"
         setattr(page, "_bot_may_edit", True)
-        page.text = str(parsed)
-        page.save(summary="autogenerate objectives", minor=False)
+        saves.append(edit_scheduler(page.site).submit(page, str(parsed), "autogenerate objectives", minor=False,
+                                                      priority=EditPriority.UPDATE))
+    edit_scheduler().finish(saves)
 
 
 def main():
@@ -2,11 +2,14 @@ import pywikibot as pwb
 from pywikibot.pagegenerators import GeneratorFactory
 import re
 
+from edit_scheduler import edit_scheduler, EditPriority
+
 s = pwb.Site()
 
 def navbox1():
     schools = ["Abydos", "Gehenna", "Hyakkiyako", "Millennium", "Red Winter", "Shanhaijing", "SRT", "Trinity", "Valkyrie"]
 
+    saves = []
     for school in schools:
         gen = GeneratorFactory(site=s)
         gen.handle_args(["-cat:Students of " + school, "-ns:0"])
@@ -19,14 +22,16 @@ def navbox1():
                 print("No change on " + page.title())
                 continue
             setattr(page, "_bot_may_edit", True)
-            page.text = text
-            page.save("Replace navbox with [[Template:Kivotos]]", minor=True)
+            saves.append(edit_scheduler(s).submit(page, text, "Replace navbox with [[Template:Kivotos]]",
+                                                  priority=EditPriority.COSMETIC))
+    edit_scheduler(s).finish(saves)
 
 
 def main():
     gen = GeneratorFactory(site=s)
     gen.handle_args(["-cat:Club navbox"])
     gen = gen.getCombinedGenerator()
+    saves = []
     for club in gen:
         club: pwb.Page
         club_name = club.title(with_ns=False)
@@ -44,8 +49,8 @@ def main():
                 print("Skipping " + char_page.title())
                 continue
             setattr(char_page, "_bot_may_edit", True)
-            char_page.text = text
-            char_page.save("Add club tempalte", minor=True)
+            saves.append(edit_scheduler(s).submit(char_page, text, "Add club tempalte", priority=EditPriority.COSMETIC))
+    edit_scheduler(s).finish(saves)
 
 
 if __name__ == "__main__":
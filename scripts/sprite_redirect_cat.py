@@ -3,10 +3,14 @@ import re
 from pywikibot import Site
 from pywikibot.pagegenerators import GeneratorFactory, AllpagesPageGenerator
 
+from edit_scheduler import edit_scheduler, EditPriority
+
 s = Site()
 gen = AllpagesPageGenerator(start="!", namespace="File", includeredirects=True, site=s, content=True)
+saves = []
 for page in gen:
     if "REDIRECT" in page.text and "ategory" not in page.text and re.search(r"[_ ]\d\d\.png", page.title()) is not None:
-        page.text += "\n[[Category:Character sprite redirects]]"
-        page.save(summary="add category to track sprite redirects")
+        saves.append(edit_scheduler(s).submit(page, page.text + "\n[[Category:Character sprite redirects]]",
+                                              "add category to track sprite redirects", priority=EditPriority.COSMETIC))
+edit_scheduler(s).finish(saves)
 
@@ -3,20 +3,18 @@ from pathlib import Path
 import json
 import re
 
-import pywikibot as pwb
-from pywikibot.pagegenerators import GeneratorFactory
+from edit_scheduler import edit_scheduler, EditPriority
+from wiki import Site, Page, scan_categories
 
-s = pwb.Site()
+s = Site()
 skill_file = Path("skills/skill_classifications.json")
-f = GeneratorFactory(s)
-f.handle_args(['-cat:Characters', '-ns:0'])
-gen = f.getCombinedGenerator(preload=True)
+gen = scan_categories(['Characters'], namespaces=[0], site=s)
 
 
 def pull():
     result: dict[str, list[str]] = {}
     for page in gen:
-        page: pwb.Page
+        page: Page
         text = page.text
         classifications = []
         skill_types = re.search(r"\{\{ *skill types *\|([a-zA-Z |-]+)}}", text, re.IGNORECASE)
@@ -28,8 +26,9 @@ def pull():
 
 def push():
     result: dict[str, list[str]] = json.load(open(skill_file, "r"))
+    saves = []
     for page in gen:
-        page: pwb.Page
+        page: Page
         title = page.title()
         if title not in result:
             print("ERROR: " + title + " has no corresponding skill type")
@@ -46,8 +45,9 @@ def push():
             print("No update on " + title)
             continue
         setattr(page, "_bot_may_edit", True)
-        page.text = text
-        page.save(summary="update skill types", minor=False)
+        saves.append(edit_scheduler(s).submit(page, text, "update skill types", minor=False,
+                                              priority=EditPriority.UPDATE))
+    edit_scheduler(s).finish(saves)
 
 
 def make_categories():
@@ -56,6 +56,7 @@ def make_categories():
 
     lines = open("skills/categories.txt", "r").readlines()
     skill_stack = ["" for _ in range(10)]
+    saves = []
     for line in lines:
         line = line.rstrip()
         spacing = len(line) - len(line.lstrip())
@@ -67,12 +68,12 @@ def make_categories():
         title = "Category:" + line
         text = "{{catnav|" + "|".join(parents) + f"|{line}" + "}}\n\n"
         text = text + f"[[Category:{parents[-1]}]]"
-        page = pwb.Page(s, title)
+        page = Page(s, title)
         setattr(page, "_bot_may_edit", True)
         if page.text.strip() == text.strip():
             continue
-        page.text = text
-        page.save(summary="Mass update skill-related categories")
+        saves.append(edit_scheduler(s).submit(page, text, "Mass update skill-related categories"))
+    edit_scheduler(s).finish(saves)
 
 
 def stat():
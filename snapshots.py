@@ -0,0 +1,104 @@
+"""
+Pickle snapshots of the tables in json/, which decode much faster than the JSON they are compiled from. Kept apart
+from utils.py so that update.py can compile them without pywikibot.
+"""
+import json
+import os
+import pickle
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from xxhash import xxh3_64_hexdigest
+
+snapshot_dir = Path("cache/snapshots")
+snapshot_index_path = snapshot_dir / "index.json"
+# resolved path -> [size, mtime_ns, content hash] of the source the snapshot was compiled from
+snapshot_index: dict[str, list] = {}
+
+
+@contextmanager
+def file_lock(path: Path, stale_after: float = 60.0):
+    """Hold the lock file path, for caches that generators running at the same time update."""
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > stale_after:
+                    # left behind by a process that was killed while holding it
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        path.unlink(missing_ok=True)
+
+
+def get_source_digest(path: Path) -> str:
+    """
+    Content hash of a downloaded table. The stat info recorded in the snapshot index lets unchanged files skip
+    rehashing.
+    """
+    if len(snapshot_index) == 0 and snapshot_index_path.exists():
+        snapshot_index.update(json.load(open(snapshot_index_path, "r", encoding="utf-8")))
+    key = str(path.resolve())
+    stat = path.stat()
+    entry = snapshot_index.get(key)
+    if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+    digest = xxh3_64_hexdigest(path.read_bytes())
+    snapshot_index[key] = [stat.st_size, stat.st_mtime_ns, digest]
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    # other processes may have added entries since this one read the index
+    with file_lock(snapshot_index_path.with_suffix(".lock")):
+        merged = {}
+        if snapshot_index_path.exists():
+            with open(snapshot_index_path, "r", encoding="utf-8") as f:
+                # entries keyed by file name alone are from before the index was keyed by path
+                merged = dict((k, v) for k, v in json.load(f).items() if Path(k).is_absolute())
+        merged[key] = snapshot_index[key]
+        tmp = snapshot_index_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(merged, f, indent=4)
+        tmp.replace(snapshot_index_path)
+    snapshot_index.update(merged)
+    return digest
+
+
+def compile_json(path: Path) -> Path:
+    """
+    Convert a table in json/ into a pickle snapshot named after the content hash of the source, removing snapshots
+    of older versions of the same file.
+    """
+    digest = get_source_digest(path)
+    snapshot = snapshot_dir / f"{path.name}.{digest}.pickle"
+    if snapshot.exists():
+        return snapshot
+    with open(path, "r", encoding="utf-8") as f:
+        loaded = json.load(f)
+    # other processes may be converting the same table at the same time
+    for stale in snapshot_dir.glob(f"{path.name}.*.pickle"):
+        if stale != snapshot:
+            stale.unlink(missing_ok=True)
+    tmp = snapshot.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(loaded, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(snapshot)
+    return snapshot
+
+
+def compile_json_tables():
+    for path in sorted(Path("json").glob("*.json")):
+        compile_json(path)
+
+
+def read_json(path: Path) -> Any:
+    """Decode a table in json/ through its compiled snapshot, which is rebuilt whenever the source changes."""
+    with open(compile_json(path), "rb") as f:
+        return pickle.load(f)
@@ -2,12 +2,12 @@ import logging
 import re
 from dataclasses import dataclass
 
-from pywikibot import Page
-from pywikibot.pagegenerators import GeneratorFactory
+from wiki import Page, scan_categories
 
-from story.story_parser import make_story_text
+from story.profiling import profiled_run
+from story.story_parser import StorySpec, render_stories
 from story.story_utils import make_story_nav, NavArgs, StoryType, StoryInfo, make_story_list_nav
-from utils import load_json, s, save_page
+from utils import load_json, s, save_pages, PageEdit, journaled_run
 
 
 @dataclass
@@ -60,9 +60,7 @@ class WikiEvent:
 
 
 def get_wiki_events() -> list[WikiEvent]:
-    gen = GeneratorFactory()
-    gen.handle_args(['-cat:Events', '-ns:0', '-titleregexnot:.*/.*'])
-    gen = gen.getCombinedGenerator(preload=True)
+    gen = scan_categories(['Events'], namespaces=[0], exclude=".*/.*")
     result = []
 
     for page in gen:
@@ -78,15 +76,17 @@ def get_wiki_events() -> list[WikiEvent]:
 
 def make_event_stories():
     event_stories: dict[int, list[StoryInfo]] = {}
-    for event in load_event_stories():
+    events = load_event_stories()
+    stories = render_stories([StorySpec(event.scenario_groups, StoryType.EVENT) for event in events])
+    for event, story in zip(events, stories):
         if event.event_content_id not in event_stories:
             event_stories[event.event_content_id] = []
-        story = make_story_text(event.scenario_groups, StoryType.EVENT)
         if story is None:
             logging.error(f"Could not parse story for event {event.event_content_id}")
             continue
         event_stories[event.event_content_id].append(story)
     event_pages = dict((e.event_id, e) for e in get_wiki_events())
+    edits: list[PageEdit] = []
     for event_id, story_list in event_stories.items():
         if event_id not in event_pages:
             logging.warning(f"Could not find event page for event id {event_id}")
@@ -98,42 +98,44 @@ def make_event_stories():
         make_story_list_nav(story_list, story_page_title_template.format(""))
         for story_index, story in enumerate(story_list, 1):
             story_page_title = story_page_title_template.format(str(story_index))
-            story_page = Page(s, story_page_title)
-            save_page(story_page, story.full_text, summary="batch create event story page")
+            edits.append(PageEdit(story_page_title, story.full_text, "batch create event story page"))
             story_titles.append((story_page_title, story.title))
         # There's some special navigation for Valentine stories. Do not touch this page.
         if "♡" in story_root_page_title and "Valentine" in story_root_page_title:
             continue
-        story_root_page = Page(s, story_root_page_title)
         root_page_text = "<noinclude>{{EventStoryTop}}</noinclude>\n"
         root_page_text += "\n".join(
             f"#[[{titles[0]}|{titles[1]}]]" for index, titles in enumerate(story_titles, start=1))
         root_page_text += "<noinclude>[[Category:Event stories]]</noinclude>"
-        save_page(story_root_page, root_page_text, summary="batch create event story navigation page")
+        edits.append(PageEdit(story_root_page_title, root_page_text, "batch create event story navigation page"))
+    save_pages(edits)
 
 
 def make_valentine_stories():
     meetups = load_valentine_meetups()
     name_to_story: dict[str, StoryInfo] = {}
-    for scenario_group_id in meetups:
-        story = make_story_text(scenario_group_id, StoryType.EVENT)
+    stories = render_stories([StorySpec(scenario_group_id, StoryType.EVENT) for scenario_group_id in meetups])
+    for story in stories:
         # The most frequently appearing character is probably the one we're looking for
         char_name = list(sorted(story.chars.items(), key=lambda item: item[1], reverse=True))[0][0]
         name_to_story[char_name] = story
     root_page = Page(s, "Happy Schale ♡ Valentine patrol/Story")
     assert root_page.exists() and not root_page.isRedirectPage()
     story_list = []
+    edits: list[PageEdit] = []
     for char_name, story in name_to_story.items():
-        page = Page(s, root_page.title() + "/" + char_name)
-        save_page(page, story.full_text, summary="valentine character dating story page")
-        story_list.append(f"* [[{page.title()}|{char_name}: {story.title}]]")
+        page_title = Page(s, root_page.title() + "/" + char_name).title()
+        edits.append(PageEdit(page_title, story.full_text, "valentine character dating story page"))
+        story_list.append(f"* [[{page_title}|{char_name}: {story.title}]]")
+    save_pages(edits)
     # page = Page(s, "Happy Schale ♡ Valentine patrol/Dates")
     # save_page(page, "\n".join(story_list), summary="valentine dating stories page")
 
 
 def main():
-    make_event_stories()
-    # make_valentine_stories()
+    with profiled_run("event_story"), journaled_run("event_story"):
+        make_event_stories()
+        # make_valentine_stories()
 
 
 if __name__ == '__main__':
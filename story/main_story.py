@@ -1,17 +1,17 @@
 from dataclasses import dataclass
 
-from pywikibot import Page
-from pywikibot.pagegenerators import PreloadingGenerator
+from wiki import Page
 
-from story.story_parser import make_story_text
+from story.profiling import profiled_run
+from story.story_parser import StorySpec, render_stories
 from story.story_utils import s, get_main_scenarios, StoryType, NavArgs, make_story_nav, \
     StoryInfo
-from utils import save_page
+from utils import save_page, save_pages, PageEdit, journaled_run
 
 
-def make_main_story_text(event: dict) -> StoryInfo | None:
+def make_main_story_spec(event: dict) -> StorySpec:
     ids = event["FrontScenarioGroupId"] + event["BackScenarioGroupId"]
-    return make_story_text(ids, story_type=StoryType.MAIN)
+    return StorySpec(ids, story_type=StoryType.MAIN)
 
 
 @dataclass
@@ -63,7 +63,8 @@ def make_main_story():
     all_episodes: EpisodeDict = {}
     id_to_story: dict[int, MainStory] = {}
 
-    for scenario in scenarios:
+    story_infos = render_stories([make_main_story_spec(scenario) for scenario in scenarios])
+    for scenario, story_info in zip(scenarios, story_infos):
         scenario_group = scenario['FrontScenarioGroupId']
         if len(scenario_group) == 0:
             scenario_group = scenario['BackScenarioGroupId']
@@ -75,7 +76,6 @@ def make_main_story():
         assert mode in {"Main", "SpecialOperation"}, f"Unknown mode {mode}"
         if mode == 'SpecialOperation':
             volume = 114514
-        story_info = make_main_story_text(scenario)
         if story_info is None:
             print(make_main_story_title(volume, chapter, episode) + " cannot be found")
             continue
@@ -94,13 +94,8 @@ def make_main_story():
     # Do not call this function unless you want to regenerate these
     generate_parent_page(all_episodes)
 
-    gen = PreloadingGenerator(Page(s, story.page) for story in id_to_story.values())
-    title_to_page: dict[str, Page] = dict((page.title(), page) for page in gen)
-
-    for story_id, story in id_to_story.items():
-        story_info = story.story_info
-        page = title_to_page[story.page]
-        save_page(page, story_info.full_text, summary="update main story pages")
+    save_pages(PageEdit(story.page, story.story_info.full_text, "update main story pages")
+               for story in id_to_story.values())
 
 
 def generate_nav(all_episodes, id_to_story: dict[int, MainStory]):
@@ -146,7 +141,8 @@ def generate_nav(all_episodes, id_to_story: dict[int, MainStory]):
 
 
 def main():
-    make_main_story()
+    with profiled_run("main_story"), journaled_run("main_story"):
+        make_main_story()
 
 
 if __name__ == "__main__":
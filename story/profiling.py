@@ -0,0 +1,134 @@
+"""
+Opt-in timings and counters for story generation. Enable with BA_PROFILE=1 or by passing --profile to one of the
+story generators; when disabled every hook returns immediately.
+
+Phases and counters recorded while a story is rendered are attributed to that story, everything else (table loading,
+navigation between pages) to the run. Worker processes send their story profiles back with the rendered story.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+from utils import json_cache, print_cache_stats
+
+profile_dir = Path("cache/profile")
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get("BA_PROFILE", "0") not in ("", "0")
+
+
+@dataclass
+class StoryProfile:
+    story: str
+    phases: dict[str, float] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+
+run_profile = StoryProfile("run")
+story_profiles: list[StoryProfile] = []
+current_profile: StoryProfile | None = None
+
+
+@contextmanager
+def phase(name: str):
+    if not profiling_enabled():
+        yield
+        return
+    profile = current_profile if current_profile is not None else run_profile
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[name] = profile.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name: str, n: int = 1):
+    if not profiling_enabled():
+        return
+    profile = current_profile if current_profile is not None else run_profile
+    profile.counters[name] = profile.counters.get(name, 0) + n
+
+
+@contextmanager
+def story_profile(story: str):
+    """Attribute phases and counters to one story. Yields None when profiling is disabled."""
+    global current_profile
+    if not profiling_enabled():
+        yield None
+        return
+    previous = current_profile
+    current_profile = StoryProfile(story)
+    try:
+        yield current_profile
+    finally:
+        current_profile = previous
+
+
+def record_story(profile: StoryProfile | None):
+    if profile is not None:
+        story_profiles.append(profile)
+
+
+def make_report(name: str, wall_time: float) -> dict:
+    phases: dict[str, float] = dict(run_profile.phases)
+    counters: dict[str, int] = dict(run_profile.counters)
+    for profile in story_profiles:
+        for k, v in profile.phases.items():
+            phases[k] = phases.get(k, 0.0) + v
+        for k, v in profile.counters.items():
+            counters[k] = counters.get(k, 0) + v
+    return {
+        "name": name,
+        "wall_time": wall_time,
+        "story_count": len(story_profiles),
+        "phases": phases,
+        "counters": counters,
+        # of this process; rendering workers keep their own
+        "json_cache": json_cache.stats(),
+        "stories": [asdict(p) | {"total": p.total}
+                    for p in sorted(story_profiles, key=lambda p: p.total, reverse=True)],
+    }
+
+
+def print_slowest(report: dict, top: int = 20):
+    print(f"{'story':<40}{'total ms':>10}{'lines':>8}{'events':>8}  slowest phase")
+    for story in report['stories'][:top]:
+        slowest = max(story['phases'].items(), key=lambda kv: kv[1], default=("", 0.0))
+        print(f"{story['story']:<40}{story['total'] * 1000:>10.1f}{story['counters'].get('lines', 0):>8}"
+              f"{story['counters'].get('events', 0):>8}  {slowest[0]} ({slowest[1] * 1000:.1f} ms)")
+
+
+@contextmanager
+def profiled_run(name: str, top: int = 20):
+    """
+    Wrap a generator's main function. With profiling enabled, writes cache/profile/<name>-<time>.json and prints the
+    slowest stories once the run finishes.
+    """
+    if "--profile" in sys.argv:
+        # set in the environment so that rendering workers see it too
+        os.environ["BA_PROFILE"] = "1"
+    if not profiling_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report = make_report(name, time.perf_counter() - start)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        path = profile_dir / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+        json.dump(report, open(path, "w", encoding="utf-8"), indent=4)
+        print_slowest(report, top)
+        if json_cache.budget is None:
+            # otherwise printed at exit
+            print_cache_stats()
+        print(f"Profile written to {path}")
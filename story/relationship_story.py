@@ -1,12 +1,9 @@
-import itertools
 from dataclasses import dataclass, field
 
-from pywikibot import Page
-from pywikibot.pagegenerators import PreloadingGenerator
-
-from story.story_parser import make_story_text
+from story.profiling import profiled_run
+from story.story_parser import StorySpec, render_stories
 from story.story_utils import s, StoryType, StoryInfo, make_story_nav, NavArgs
-from utils import load_favor_schedule, get_character_table, save_page
+from utils import load_favor_schedule, get_character_table, save_pages, PageEdit, journaled_run
 
 
 @dataclass
@@ -30,12 +27,16 @@ class CharacterStory:
         return f"{self.char_name}/Relationship Story"
 
 
-def parse_character_relationship_story(event_list: list[dict], char_name: str) -> CharacterStory:
+def make_relationship_story_spec(event: dict, char_name: str) -> StorySpec:
+    return StorySpec(event['ScenarioSriptGroupId'], StoryType.RELATIONSHIP, character_name=char_name)
+
+
+def parse_character_relationship_story(event_list: list[dict], char_name: str,
+                                       stories: list[StoryInfo | None]) -> CharacterStory:
     char_story = CharacterStory(char_name)
     base_text = ["{{Story/RelationshipStoryTop}}"]
-    for index, event in enumerate(event_list, 1):
+    for index, (event, story) in enumerate(zip(event_list, stories), 1):
         favor_level = event["FavorRank"]
-        story = make_story_text(event['ScenarioSriptGroupId'], StoryType.RELATIONSHIP, character_name=char_name)
         if story is None:
             raise RuntimeError(f"Story of {char_name} with event {event} failed to parse")
         story = RelationshipStory(story, index, favor_level)
@@ -51,13 +52,20 @@ def parse_all_relationship_story_pages():
     favor_schedule = load_favor_schedule()
     character_table = get_character_table()
     all_stories: list[CharacterStory] = []
+    characters: list[tuple[int, list[dict]]] = []
     for character_id, event_list in favor_schedule.items():
         if character_id not in character_table:
             print(f"Character id {character_id} has no corresponding name.")
             continue
+        characters.append((character_id, event_list))
+    rendered = iter(render_stories([make_relationship_story_spec(event, character_table[character_id])
+                                    for character_id, event_list in characters
+                                    for event in event_list]))
+    for character_id, event_list in characters:
+        stories = [next(rendered) for _ in event_list]
         try:
             char_name = character_table[character_id]
-            story = parse_character_relationship_story(event_list, char_name)
+            story = parse_character_relationship_story(event_list, char_name, stories)
             all_stories.append(story)
         except NotImplementedError as e:
             print(e)
@@ -82,24 +90,19 @@ def parse_all_relationship_story_pages():
 
 def make_relationship_stories():
     stories = parse_all_relationship_story_pages()
-    all_titles = itertools.chain.from_iterable([[char_stories.page] + [story.page(char_stories.char_name)
-                                                                       for story in char_stories.story_list]
-                                                for char_stories in stories])
-    pages = PreloadingGenerator(Page(s, title) for title in all_titles)
-    title_to_page: dict[str, Page] = dict((p.title(), p) for p in pages)
+    edits: list[PageEdit] = []
     for char_stories in stories:
         char_name = char_stories.char_name
         for story in char_stories.story_list:
-            page_title = story.page(char_name)
-            assert page_title in title_to_page, f"{story.page} is not in cached page list"
-            page = title_to_page[page_title]
-            save_page(page, story.story_info.full_text, "batch generate relationship story pages")
-        page = title_to_page[char_stories.page]
-        save_page(page, char_stories.text, "batch generate relationship story pages")
+            edits.append(PageEdit(story.page(char_name), story.story_info.full_text,
+                                  "batch generate relationship story pages"))
+        edits.append(PageEdit(char_stories.page, char_stories.text, "batch generate relationship story pages"))
+    save_pages(edits)
 
 
 def main():
-    make_relationship_stories()
+    with profiled_run("relationship_story"), journaled_run("relationship_story"):
+        make_relationship_stories()
 
 
 if __name__ == "__main__":
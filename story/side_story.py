@@ -1,10 +1,11 @@
 from itertools import groupby
 
-from pywikibot import Page
+from wiki import Page
 
-from story.story_parser import make_story_text
+from story.profiling import profiled_run
+from story.story_parser import StorySpec, render_stories
 from story.story_utils import StoryType, make_story_list_nav
-from utils import load_json, s, save_page, get_localized_club_name
+from utils import load_json, s, get_localized_club_name, save_pages, PageEdit, journaled_run
 
 
 def get_side_stories() -> dict[int, list[dict]]:
@@ -19,28 +20,35 @@ def make_side_stories():
     all_stories = get_side_stories()
     group_story_page = Page(s, "Group Story")
     group_story_page_text = []
-    for _, story_list in all_stories.items():
+    edits: list[PageEdit] = []
+    for story_list in all_stories.values():
         story_list.sort(key=lambda k: k['EpisodeId'])
+    rendered = iter(render_stories([StorySpec(event["FrontScenarioGroupId"] + event["BackScenarioGroupId"],
+                                              StoryType.GROUP)
+                                    for story_list in all_stories.values() for event in story_list]))
+    for _, story_list in all_stories.items():
         club = story_list[0]["NeedClub"]
         assert club != "None"
-        stories = [make_story_text(event["FrontScenarioGroupId"] + event["BackScenarioGroupId"], StoryType.GROUP) for event in story_list]
+        stories = [next(rendered) for _ in story_list]
         root_page = Page(s, f"{group_story_page.title()}/{club}")
         localized_club = get_localized_club_name(club)
         root_page_text = [f"{{{{ClubStoryTop | name={localized_club} }}}}"]
         make_story_list_nav(stories, root_page.title() + "/")
         group_story_page_text.append(f"==[[/{club}|{localized_club}]]==")
         for index, story in enumerate(stories, 1):
-            page = Page(s, f"{root_page.title()}/{index}")
-            save_page(page, story.full_text, "Batch create club stories")
-            root_page_text.append(f";[[{page.title()}|{story.title}]]\n{story.summary}")
-            group_story_page_text.append(f"# [[{page.title()}|{story.title}]]")
+            page_title = f"{root_page.title()}/{index}"
+            edits.append(PageEdit(page_title, story.full_text, "Batch create club stories"))
+            root_page_text.append(f";[[{page_title}|{story.title}]]\n{story.summary}")
+            group_story_page_text.append(f"# [[{page_title}|{story.title}]]")
         root_page_text.append("{{ClubStoryBottom}}")
-        save_page(root_page, "\n".join(root_page_text), "Batch create club stories")
-    save_page(group_story_page, "\n".join(group_story_page_text), "Batch create club stories")
+        edits.append(PageEdit(root_page.title(), "\n".join(root_page_text), "Batch create club stories"))
+    edits.append(PageEdit(group_story_page.title(), "\n".join(group_story_page_text), "Batch create club stories"))
+    save_pages(edits)
 
 
 def main():
-    make_side_stories()
+    with profiled_run("side_story"), journaled_run("side_story"):
+        make_side_stories()
 
 
 if __name__ == "__main__":
@@ -1,18 +1,19 @@
-from pywikibot import Page
+from wiki import Page
 
-from utils import get_character_table, s, save_page
+from utils import get_character_table, s, save_pages, PageEdit, journaled_run
 
 
 def make_character_story_subpages():
-    for char in get_character_table().values():
-        p = Page(s, char)
-        assert p.exists()
-        p = Page(s, f"{char}/story")
-        save_page(p, "{{CharacterStories}}", summary="batch create character story pages")
+    characters = list(get_character_table().values())
+    for p in s.preloadpages([Page(s, char) for char in characters], content=False):
+        assert p.exists(), p.title()
+    save_pages(PageEdit(f"{char}/story", "{{CharacterStories}}", "batch create character story pages")
+               for char in characters)
 
 
 def main():
-    make_character_story_subpages()
+    with journaled_run("story_main"):
+        make_character_story_subpages()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,26 @@
+import os
+import pickle
 import re
+import shutil
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import DefaultDict
+from enum import Enum
+from functools import cache
+from io import StringIO
+from pathlib import Path
+from typing import DefaultDict, Iterable, Iterator, TextIO
+
+from xxhash import xxh3_128_hexdigest
 
 from story.log_utils import logger
+from story.profiling import phase, count, story_profile, record_story, StoryProfile, profiling_enabled
 from story.story_utils import strip_st_line, get_story_event, make_categories, get_story_title_and_summary, StoryType, \
-    StoryInfo
-from utils import get_bgm_file_info, music_file_name_to_title, get_background_file_name, signature_escape
+    StoryInfo, ScenarioLine, get_scenario_character_id, get_speaker_index, get_existing_sprites, get_scenario_index, \
+    story_table_keys
+from utils import get_bgm_file_info, music_file_name_to_title, get_background_file_name, signature_escape, \
+    load_bgm_file_info, get_music_dict, get_worker_count, json_cache
 
 
 def story_type_to_cat(story_type: StoryType):
@@ -19,8 +33,84 @@ def story_type_to_cat(story_type: StoryType):
     }.get(story_type)
 
 
-zmc_regex = re.compile(r"#zmc;(instant|move);-?\d+,-?\d+;\d+(;\d+)?")
-st_regex = re.compile(r"#st;\[-?\d+,-?\d+];(serial|instant);\d+;")
+class Command(Enum):
+    TEXT = 0
+    WAIT = 1
+    ZMC = 2
+    HIDE_ALL = 3
+    CHARACTER = 4
+    FONT_SIZE = 5
+    CLEAR_ST = 6
+    SHAKE = 7
+    ST = 8
+    TITLE = 9
+    PLACE = 10
+    CONTINUED = 11
+    NA = 12
+    NEXT_EPISODE = 13
+
+
+# Commands that only affect presentation and are dropped from the script before it is interpreted
+effect_commands = {Command.WAIT, Command.ZMC, Command.HIDE_ALL, Command.CHARACTER, Command.FONT_SIZE,
+                   Command.CLEAR_ST, Command.SHAKE}
+command_regex = re.compile("|".join(f"(?P<{command.name}>{pattern})" for command, pattern in [
+    (Command.WAIT, r"#wait;\d+"),
+    (Command.ZMC, r"#zmc;(?:instant|move);-?\d+,-?\d+;\d+(?:;\d+)?"),
+    (Command.HIDE_ALL, r"#all;hide"),
+    (Command.CHARACTER, r"#\d;(?:hide|closeup|stiff|shake|dr|jump|d|em)?"),
+    (Command.FONT_SIZE, r"#fontsize;\d+"),
+    (Command.CLEAR_ST, r"#clearst"),
+    (Command.SHAKE, r"#bgshake"),
+    (Command.ST, r"#st;\[-?\d+,-?\d+];(?:serial|instant);\d+;"),
+    (Command.TITLE, r"#title;"),
+    (Command.PLACE, r"#place;"),
+    (Command.CONTINUED, r"#continued"),
+    (Command.NA, r"#na;"),
+    (Command.NEXT_EPISODE, r"#nextepisode;"),
+]))
+wa_regex = re.compile(r"\[wa:\d+]")
+log_regex = re.compile(r"\[log=([^]]+)]")
+log_tag_regex = re.compile(r"\[/?log=([^]]+)]")
+anonymous_log_tag_regex = re.compile(r"\[/?log]")
+option_regex = re.compile(r"\[n?s\d*]")
+
+
+@dataclass(slots=True)
+class ScriptToken:
+    command: Command
+    text: str
+
+
+def tokenize_script(script: str) -> list[ScriptToken]:
+    """
+    Split a (lowercased) ScriptKr string into commands and the plain text between them in a single left-to-right
+    pass.
+    """
+    if "#" not in script:
+        return [ScriptToken(Command.TEXT, script)] if script != "" else []
+    tokens: list[ScriptToken] = []
+    position = 0
+    for match in command_regex.finditer(script):
+        start = match.start()
+        if start > position:
+            tokens.append(ScriptToken(Command.TEXT, script[position:start]))
+        tokens.append(ScriptToken(Command[match.lastgroup], match.group()))
+        position = match.end()
+    if position < len(script):
+        tokens.append(ScriptToken(Command.TEXT, script[position:]))
+    return tokens
+
+
+def lead_command(tokens: list[ScriptToken]) -> tuple[Command, str]:
+    """The first command of a line, ignoring leading whitespace, and the text of the token right after it."""
+    for index, token in enumerate(tokens):
+        if token.command == Command.TEXT:
+            if token.text.strip() == "":
+                continue
+            return Command.TEXT, ""
+        following = tokens[index + 1].text if index + 1 < len(tokens) else ""
+        return token.command, following
+    return Command.TEXT, ""
 
 
 def process_info(text) -> str:
@@ -36,18 +126,77 @@ def process_info(text) -> str:
     return text
 
 
-def event_list_to_template(event_list: list[dict[str, str]]) -> str:
-    result = ["{{Story"]
-    for index, event in enumerate(event_list, 1):
-        for k, v in event.items():
-            if "%d" in k:
-                key = k.replace("%d", str(index))
-            else:
-                key = f"{k}{index}"
-            result.append(f"|{key}={v}")
-        result.append("")
-    result.append("}}")
-    return "\n".join(result)
+class EventKind(Enum):
+    INFO = "info"
+    SOUND = "sound"
+    SENSEI = "sensei"
+    REPLY = "reply"
+    STUDENT_TEXT = "student-text"
+    BGM = "bgm"
+    BGM_STOP = "bgm-stop"
+    POPUP = "popup"
+    BACKGROUND = "background"
+    MEMLOBBY = "memlobby"
+
+
+@dataclass(slots=True)
+class StoryEvent:
+    kind: EventKind
+    text: str | None = None
+    # speaker of student text, or display name of a bgm or sound
+    name: str | None = None
+    affiliation: str | None = None
+    # the bgm, sound, popup, background or memorial lobby character
+    file: str | None = None
+    spine: str | None = None
+    sequence: str | None = None
+    volume: str | None = None
+    loop_start: str | None = None
+    loop_end: str | None = None
+    options: tuple[str, ...] = ()
+    group: str | None = None
+    option: str | None = None
+
+
+def format_event(event: StoryEvent, index: int) -> str:
+    kind = event.kind
+    result = f"\n|{index}={kind.value}"
+    if kind == EventKind.INFO or kind == EventKind.SENSEI:
+        result += f"\n|text{index}={event.text}"
+    elif kind == EventKind.STUDENT_TEXT:
+        result += f"\n|name{index}={event.name}\n|affiliation{index}={event.affiliation}\n|text{index}={event.text}"
+        if event.spine is not None:
+            result += f"\n|spine{index}={event.spine}\n|sequence{index}={event.sequence}"
+    elif kind == EventKind.REPLY:
+        for option_index, option in enumerate(event.options, 1):
+            result += f"\n|option{index}_{option_index}={option}"
+    elif kind == EventKind.SOUND:
+        result += f"\n|sound{index}={event.file}\n|name{index}={event.name}"
+    elif kind == EventKind.BGM:
+        result += f"\n|bgm{index}={event.file}\n|name{index}={event.name}\n|volume{index}={event.volume}"
+        if event.loop_start is not None:
+            result += f"\n|loop-start{index}={event.loop_start}\n|loop-end{index}={event.loop_end}"
+    elif kind == EventKind.POPUP or kind == EventKind.BACKGROUND or kind == EventKind.MEMLOBBY:
+        result += f"\n|{kind.value}{index}={event.file}"
+    if event.group is not None:
+        result += f"\n|group{index}={event.group}"
+        if event.option is not None:
+            result += f"\n|option{index}={event.option}"
+    return result + "\n"
+
+
+def write_story_template(events: Iterable[StoryEvent], sink: TextIO):
+    """Write the {{Story}} template for events to sink as they arrive, without collecting them first."""
+    sink.write("{{Story")
+    for index, event in enumerate(events, 1):
+        sink.write(format_event(event, index))
+    sink.write("\n}}")
+
+
+def event_list_to_template(event_list: Iterable[StoryEvent]) -> str:
+    buffer = StringIO()
+    write_story_template(event_list, buffer)
+    return buffer.getvalue()
 
 
 @dataclass
@@ -56,32 +205,46 @@ class StoryState:
     current_background: str = None
     current_popup: str = None
     live2d_mode: bool = False
+    event_count: int = 0
 
 
 @dataclass
 class ParsedStory:
-    intermediate_text: list[dict[str, str]]
+    # Lazily produced; chars and music are only complete once every event has been consumed
+    intermediate_text: Iterable[StoryEvent]
     chars: dict[str, int]
     music: set[str]
 
 
-def parse_story(lines: list[dict], story_type: StoryType, character_name: str = None) -> ParsedStory:
+def parse_story(lines: Iterable[ScenarioLine | dict], story_type: StoryType, character_name: str = None) -> ParsedStory:
     bgm_list: set[str] = set()
     character_list: dict[str, int] = defaultdict(int)
-    from story.story_utils import get_scenario_character_id
-    events: list[dict[str, str]] = []
+    return ParsedStory(
+        intermediate_text=iter_story_events(lines, story_type, character_list, bgm_list, character_name),
+        chars=character_list,
+        music=bgm_list)
+
+
+def iter_story_events(lines: Iterable[ScenarioLine | dict], story_type: StoryType, character_list: dict[str, int],
+                      bgm_list: set[str], character_name: str = None) -> Iterator[StoryEvent]:
+    # events produced by the current line; handed on before the next line is parsed
+    events: list[StoryEvent] = []
     option_group = 0
     base_selection_group = -1
     onscreen_characters = set()
     story_title = None
     story_state = StoryState()
 
-    # noinspection PyDefaultArgument
-    def add_info(info_text: str, extras: dict[str, str] = {}):
-        events.append({"": "info", "text": info_text} | extras)
+    def add_info(info_text: str, group: str | None = None, option: str | None = None):
+        events.append(StoryEvent(EventKind.INFO, text=info_text, group=group, option=option))
 
     for line in lines:
-        if "Battle" in line and line["Battle"] == True:
+        story_state.event_count += len(events)
+        yield from events
+        events.clear()
+        if isinstance(line, dict):
+            line = ScenarioLine.from_row(line)
+        if line.battle:
             add_info("A battle ensues")
             continue
 
@@ -92,87 +255,87 @@ def parse_story(lines: list[dict], story_type: StoryType, character_name: str =
 
         process_popup(events, line, story_state)
 
-        script: str = line['ScriptKr']
-        lower: str = script.lower()
-        text: str = line['TextEn']
+        script: str = line.script_kr
+        tokens = tokenize_script(script.lower())
+        text: str = line.text_en
         # FIXME: deal with emoticon?
         # text = text + "".join(extract_em(script))
         text = text.replace("#n", "<br/>")
-        text, _ = re.subn(r"\[wa:\d+]", "", text)
+        text, _ = wa_regex.subn("", text)
         text = signature_escape(text)
         text = text.strip()
-        sound: str = line['Sound']
-        selection_group: int = line['SelectionGroup']
+        sound: str = line.sound
+        selection_group: int = line.selection_group
         if selection_group != 0:
             if base_selection_group == -1:
                 base_selection_group = selection_group
                 selection_group = 1
             else:
                 selection_group = selection_group - base_selection_group + 1
-        if lower.startswith("#title;"):
+        head = tokens[0].command if len(tokens) > 0 else Command.TEXT
+        if head == Command.TITLE:
             story_title = text.split(";")[1].strip() if ";" in text else text.strip()
             continue
-        elif lower.startswith("#place;"):
+        elif head == Command.PLACE:
             add_info(text)
             continue
-        elif lower.startswith("#continued"):
+        elif head == Command.CONTINUED:
             add_info("To be continued")
             continue
 
-        is_st_line, lower = process_special_effects(lower, events)
+        is_st_line, tokens = process_special_effects(tokens, events)
 
-        lower = lower.strip()
+        lower = "".join(token.text for token in tokens).strip()
+        lead, lead_argument = lead_command(tokens)
         # Search for strings like "[log=렌게 실루엣]I'm on an adventure to reclaim my youth![/log]"
-        match = re.search(r"\[log=([^]]+)]", text)
+        match = log_regex.search(text)
         if match is not None:
             script = f"3;{match.group(1)};00;lorem ipsum"
-            text = re.sub(r"\[/?log=([^]]+)]", "", text)
+            text = log_tag_regex.sub("", text)
         # There's also text like [log]Uphold the Kadenokouji name.[/log] which don't have a speaker
-        text = re.sub(r"\[/?log]", "", text)
+        text = anonymous_log_tag_regex.sub("", text)
 
         character_query_result, speaker = get_scenario_character_id(script)
 
-        option_dict = {}
+        group, option = None, None
         if selection_group != 0:
-            option_dict = {"group": str(option_group), "option": str(selection_group)}
+            group, option = str(option_group), str(selection_group)
 
         if sound is not None and sound != "":
             sound = re.sub(r"^SE", "SE", sound, flags=re.IGNORECASE)
             sound_name = re.sub(r"^ ?(SE|SFX)_", "", sound)
             sound_name = re.sub(r"(?<! )_?([A-Z])", r" \1", sound_name)
             sound_name = re.sub(r"[_ ]\d{2}.?$", "", sound_name, flags=re.IGNORECASE)
-            events.append({"": "sound", "sound": sound, "name": sound_name.strip().lower()} | option_dict)
+            events.append(StoryEvent(EventKind.SOUND, file=sound, name=sound_name.strip().lower(),
+                                     group=group, option=option))
 
         if lower == "":
             # finished all special effects and no text left, so we are all good except for maybe sound
             if text != "":
                 print(f"Unprocessed text {text}")
             pass
-        elif lower.startswith("#nextepisode;"):
+        elif lead == Command.NEXT_EPISODE:
             add_info(text.replace(";", ": "))
-        elif lower.startswith("#na;("):
+        elif lead == Command.NA and lead_argument.startswith("("):
             text = process_info(text)
-            add_info(text, option_dict)
+            add_info(text, group, option)
             # TODO: deal with na issues
-        elif lower.startswith("#na;") and (len(character_query_result) == 0 or character_query_result[0][0] is None):
+        elif lead == Command.NA and (len(character_query_result) == 0 or character_query_result[0][0] is None):
             text = process_info(text)
-            add_info(text, option_dict)
-        elif re.search(r"\[n?s\d*]", text) is not None:
-            options = re.split(r"\[n?s\d*]", text)
+            add_info(text, group, option)
+        elif option_regex.search(text) is not None:
+            options = option_regex.split(text)
             options = options[1:]
             options = [o.strip() for o in options]
             if len(options) == 0:
                 raise RuntimeError("Expected at least 1 option for " + text)
             elif len(options) == 1:
-                events.append({"": "sensei", "text": options[0]} | option_dict)
+                events.append(StoryEvent(EventKind.SENSEI, text=options[0], group=group, option=option))
             else:
                 # sensei or reply
                 option_group += 1
                 base_selection_group = -1
-                event = {"": "reply"}
-                event.update((f"option%d_{index}", option) for index, option in enumerate(options, 1))
-                event['group'] = str(option_group)
-                events.append(event)
+                events.append(StoryEvent(EventKind.REPLY, options=tuple(options), group=str(option_group)))
         elif (len(character_query_result) > 0 and speaker is not None) or (story_state.live2d_mode and text != ""):
             # student line
             if is_st_line:
@@ -202,38 +365,31 @@ def parse_story(lines: list[dict], story_type: StoryType, character_name: str =
                     name, nickname, spine, portrait, sequence = speaker
                 if name is not None and name != "":
                     character_list[name] += 1
-                portrait_dict = {}
+                event = StoryEvent(EventKind.STUDENT_TEXT, name=name, affiliation=nickname, text=text,
+                                   group=group, option=option)
                 if spine is not None and spine != "":
                     # Ignore portrait here. Spine is almost always the better one to use.
-                    portrait_dict = {
-                        "spine": spine,
-                        "sequence": str(sequence)
-                    }
-                event = {"": "student-text", "name": name, "affiliation": nickname, "text": text}
-                event = event | portrait_dict | option_dict
+                    event.spine = spine
+                    event.sequence = str(sequence)
                 events.append(event)
         elif text != "":
             text = process_info(text)
-            add_info(text, option_dict)
+            add_info(text, group, option)
         else:
             pass
             # print(f"Unrecognizable line: {script}. Processed: {lower}.")
 
     if story_state.hanging_bgm:
-        events.append({"": "bgm-stop"})
+        events.append(StoryEvent(EventKind.BGM_STOP))
+    yield from events
 
-    return ParsedStory(
-        intermediate_text=events,
-        chars=character_list,
-        music=bgm_list)
 
-
-def process_popup(events, line, story_state):
-    if line['PopupFileName'] != "":
-        popup_name: str = line['PopupFileName']
+def process_popup(events, line: ScenarioLine, story_state):
+    if line.popup_file_name != "":
+        popup_name: str = line.popup_file_name
         popup_name = popup_name.replace('U', 'u')
         if popup_name != story_state.current_popup:
-            events.append({"": "popup", "popup": popup_name})
+            events.append(StoryEvent(EventKind.POPUP, file=popup_name))
             story_state.current_popup = popup_name
 
 
@@ -248,12 +404,13 @@ def spine_bg_conversion(original: str) -> str | None:
     }.get(original, None)
 
 
-def process_background(character_name, events, line, story_state, story_type):
-    if line['BGName'] == 0:
+def process_background(character_name, events, line: ScenarioLine, story_state, story_type):
+    if line.bg_name == 0:
         return
-    file_name = get_background_file_name(line['BGName'])
+    file_name = get_background_file_name(line.bg_name)
     if file_name is None:
-        logger.warning(f"Background image not found for {line['BGName']}")
+        count("missing_backgrounds")
+        logger.warning(f"Background image not found for {line.bg_name}")
         return
     # in some places (e.g. L2D) the same file name gets repeated multiple times
     if "SpineBG_Lobby" in file_name and story_type == StoryType.RELATIONSHIP:
@@ -269,64 +426,107 @@ def process_background(character_name, events, line, story_state, story_type):
             print(f"ERROR: spine conversion failed for {file_name}")
     if story_state.current_background != file_name:
         if file_name.startswith("Memorial Lobby"):
-            events.append({"": "memlobby", "memlobby": character_name})
+            events.append(StoryEvent(EventKind.MEMLOBBY, file=character_name))
         else:
-            events.append({"": "background", "background": file_name})
+            events.append(StoryEvent(EventKind.BACKGROUND, file=file_name))
         story_state.current_background = file_name
 
 
-def process_bgm(bgm_list, state: StoryState, line, events):
-    bgm_id = line['BGMId']
-    if bgm_id == 0 or bgm_id == 999 and len(events) <= 0:
+def process_bgm(bgm_list, state: StoryState, line: ScenarioLine, events):
+    bgm_id = line.bgm_id
+    if bgm_id == 0 or bgm_id == 999 and state.event_count + len(events) <= 0:
         return
     # sometimes bgm stop is issued at the start; need to avoid that
     if bgm_id == 999:
-        events.append({"": "bgm-stop"})
+        events.append(StoryEvent(EventKind.BGM_STOP))
         state.hanging_bgm = False
         return
     bgm_list.add(bgm_id)
     bgm = get_bgm_file_info(bgm_id)
     bgm_title = music_file_name_to_title(bgm.name)
 
-    loop_dict = {}
+    event = StoryEvent(EventKind.BGM, file=bgm.name, name=bgm_title, volume=f"{bgm.volume:.2f}")
     if bgm.loop_start is not None or bgm.loop_end is not None:
         if abs(bgm.loop_end - 0.0) > 0.0001:
-            loop_dict = {
-                "loop-start": f"{bgm.loop_start:.2f}",
-                "loop-end": f"{bgm.loop_end:.2f}",
-            }
-
-    events.append(
-        {
-            "": "bgm",
-            "bgm": bgm.name,
-            "name": bgm_title,
-            "volume": f"{bgm.volume:.2f}",
-        } | loop_dict)
+            event.loop_start = f"{bgm.loop_start:.2f}"
+            event.loop_end = f"{bgm.loop_end:.2f}"
+
+    events.append(event)
     state.hanging_bgm = True
 
 
-def process_special_effects(lower: str, events: list[dict[str, str]]):
+def process_special_effects(tokens: list[ScriptToken],
+                            events: list[StoryEvent]) -> tuple[bool, list[ScriptToken]]:
     # process special commands
     is_st_line = True
-    while re.search(r"#wait;\d+", lower) is not None:
-        lower = re.sub(r"#wait;\d+", "", lower)
-    if "#all;hide" in lower:
-        lower = lower.replace("#all;hide", "")
-    while re.search(zmc_regex, lower) is not None:
-        lower, _ = re.subn(zmc_regex, "", lower)
-    while re.search(r"#\d;", lower) is not None:
-        lower, _ = re.subn(r"#\d;(hide|closeup|stiff|shake|dr|jump|d|em)?", "", lower)
-    if re.search(st_regex, lower) is not None or lower.startswith("#st;"):
-        is_st_line = True
-    while "#fontsize;" in lower:
-        lower = re.sub(r"#fontsize;\d+", "", lower)
-    if "#clearst" in lower:
-        lower = lower.replace("#clearst", "")
-    if "#bgshake" in lower:
-        lower = lower.replace("#bgshake", "")
-        events.append({"": "info", "text": "Screen shakes"})
-    return is_st_line, lower
+    remaining = [token for token in tokens if token.command not in effect_commands]
+    if len(remaining) != len(tokens) and any(token.command == Command.SHAKE for token in tokens):
+        events.append(StoryEvent(EventKind.INFO, text="Screen shakes"))
+    return is_st_line, remaining
+
+
+# Bump whenever a change to the parser or renderer changes the generated text, so that cached builds are redone
+PARSER_VERSION = 1
+story_build_root = Path("cache/story_build")
+story_build_dir = story_build_root / f"v{PARSER_VERSION}"
+# builds that no run has used for this long are deleted; the generators run weekly
+story_build_max_age = 30 * 24 * 3600
+
+
+def story_build_cache_enabled() -> bool:
+    return os.environ.get("BA_STORY_CACHE", "1") != "0"
+
+
+@cache
+def prune_story_builds():
+    """Delete the builds of other parser versions, and builds of older data that no run has used recently."""
+    if not story_build_root.exists():
+        return
+    for path in story_build_root.iterdir():
+        if path.is_dir() and path != story_build_dir:
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.suffix == ".pickle":
+            # builds from before the cache was split by parser version
+            path.unlink(missing_ok=True)
+    if story_build_dir.exists():
+        expired = time.time() - story_build_max_age
+        for path in story_build_dir.iterdir():
+            try:
+                if path.stat().st_mtime < expired:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                # pruned by another generator running at the same time
+                pass
+
+
+def fingerprint_story(event_ids: list[int], story_type: StoryType, cat: list[str], character_name: str | None,
+                      lines: list[ScenarioLine], titles: list[str], summaries: list[str]) -> str:
+    """
+    Hash everything the generated text of a story depends on: the scenario rows, the title and summary strings, the
+    BGM, background and speaker lookups they resolve to and the parser version.
+    """
+    bgm = {}
+    backgrounds = {}
+    speakers = {}
+    for line in lines:
+        if line.battle:
+            continue
+        if line.bgm_id not in (0, 999) and line.bgm_id not in bgm:
+            info = get_bgm_file_info(line.bgm_id)
+            bgm[line.bgm_id] = (info, music_file_name_to_title(info.name))
+        if line.bg_name != 0 and line.bg_name not in backgrounds:
+            backgrounds[line.bg_name] = get_background_file_name(line.bg_name)
+        scripts = [line.script_kr]
+        match = log_regex.search(line.text_en)
+        if match is not None:
+            scripts.append(f"3;{match.group(1)};00;lorem ipsum")
+        for script in scripts:
+            if script not in speakers:
+                speakers[script] = get_scenario_character_id(script)
+    key = (PARSER_VERSION, event_ids, story_type.name, cat, character_name, lines, titles, summaries,
+           bgm, backgrounds, speakers)
+    # repr rather than pickle: pickle output depends on object identity, repr only on values
+    return xxh3_128_hexdigest(repr(key).encode("utf-8"))
 
 
 def make_story_text(event_ids: int | list[int], story_type: StoryType, cat: str | list[str] | None = None,
@@ -337,23 +537,25 @@ def make_story_text(event_ids: int | list[int], story_type: StoryType, cat: str
         cat = [cat]
     if isinstance(event_ids, int):
         event_ids = [event_ids]
-    event_lines = []
+    event_lines: list[ScenarioLine] = []
     titles: list[str] = []
     summaries = []
     for event_id in event_ids:
-        title, summary = get_story_title_and_summary(event_id, story_type)
+        with phase("get_story_title_and_summary"):
+            title, summary = get_story_title_and_summary(event_id, story_type)
         if title is not None:
             titles.append(title)
         if summary is not None:
             summaries.append(summary)
-        lines = get_story_event(event_id)
+        with phase("get_story_event"):
+            lines = get_story_event(event_id)
         if lines is not None:
             if len(event_lines) > 0:
-                event_lines.append({"Battle": True})
+                event_lines.append(ScenarioLine(battle=True))
             event_lines.extend(lines)
     if len(event_lines) == 0:
         return None
-    parsed_story = parse_story(event_lines, story_type, character_name=character_name)
+    count("lines", len(event_lines))
     if len(titles) == 0:
         print(f"No title found for {event_ids}")
         return None
@@ -368,12 +570,95 @@ def make_story_text(event_ids: int | list[int], story_type: StoryType, cat: str
                 pass
     title = titles[0]
     summary = "\n\n".join(summaries)
-    story_text = event_list_to_template(parsed_story.intermediate_text)
+    build_path = None
+    if story_build_cache_enabled():
+        fingerprint = fingerprint_story(event_ids, story_type, cat, character_name, event_lines, titles, summaries)
+        build_path = story_build_dir / f"{fingerprint}.pickle"
+    if build_path is not None and build_path.exists():
+        with open(build_path, "rb") as f:
+            story_text, category, chars = pickle.load(f)
+        # keep it from being pruned
+        os.utime(build_path)
+        count("build_cache_hits")
+    else:
+        parsed_story = parse_story(event_lines, story_type, character_name=character_name)
+        events = parsed_story.intermediate_text
+        if profiling_enabled():
+            # parsing is lazy; collect the events first so it is not timed as part of the template
+            with phase("parse_story"):
+                events = list(events)
+            count("events", len(events))
+        with phase("template"):
+            story_text = event_list_to_template(events)
+        with phase("make_categories"):
+            category = make_categories(cat, parsed_story.chars, parsed_story.music)
+        chars = dict(parsed_story.chars)
+        if build_path is not None:
+            story_build_dir.mkdir(parents=True, exist_ok=True)
+            tmp = build_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                pickle.dump((story_text, category, chars), f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp.replace(build_path)
     story = StoryInfo(title=title,
                       summary=summary,
                       main_text=story_text,
-                      category=make_categories(cat, parsed_story.chars, parsed_story.music),
-                      chars=parsed_story.chars)
-    story.add_nav_arg("title", story.title, top_only=True)
-    story.add_nav_arg("summary", story.summary, top_only=True)
+                      category=category,
+                      chars=chars)
+    with phase("nav"):
+        story.add_nav_arg("title", story.title, top_only=True)
+        story.add_nav_arg("summary", story.summary, top_only=True)
+    return story
+
+
+@dataclass
+class StorySpec:
+    event_ids: int | list[int]
+    story_type: StoryType
+    cat: str | list[str] | None = None
+    character_name: str | None = None
+
+
+def preload_story_tables():
+    """Load the read-only tables that every story needs. Also used to initialize each rendering worker."""
+    get_story_title_and_summary(0, StoryType.MAIN)
+    get_scenario_index()
+    get_speaker_index()
+    get_existing_sprites()
+    get_background_file_name(0)
+    load_bgm_file_info()
+    get_music_dict()
+
+
+def render_story(spec: StorySpec) -> StoryInfo | None:
+    story, profile = render_story_profiled(spec)
+    record_story(profile)
     return story
+
+
+def render_story_profiled(spec: StorySpec) -> tuple[StoryInfo | None, StoryProfile | None]:
+    with story_profile(f"{spec.story_type.name.lower()} {spec.event_ids}") as profile:
+        story = make_story_text(spec.event_ids, spec.story_type, cat=spec.cat, character_name=spec.character_name)
+    return story, profile
+
+
+def render_stories(specs: list[StorySpec], workers: int | None = None) -> list[StoryInfo | None]:
+    """
+    Render independent stories in a process pool. Results are returned in the order of specs, so navigation built
+    from them does not depend on which worker finished first.
+    """
+    if workers is None:
+        workers = get_worker_count()
+    # Load in this process first: forked workers then inherit the tables, and anything fetched from the wiki or
+    # written to cache/ only happens once.
+    if story_build_cache_enabled():
+        prune_story_builds()
+    with json_cache.pinned(*story_table_keys):
+        with phase("load_tables"):
+            preload_story_tables()
+        if workers <= 1 or len(specs) <= 1:
+            return [render_story(spec) for spec in specs]
+        with ProcessPoolExecutor(min(workers, len(specs)), initializer=preload_story_tables) as pool:
+            results = list(pool.map(render_story_profiled, specs, chunksize=max(1, len(specs) // (workers * 4))))
+    for _, profile in results:
+        record_story(profile)
+    return [story for story, _ in results]
@@ -1,23 +1,24 @@
 import json
+import os
+import pickle
 import re
 from dataclasses import dataclass, asdict, field
 from enum import Enum
-from functools import cache, cached_property
+from functools import cache, cached_property, lru_cache
 from pathlib import Path
 
-from pywikibot.pagegenerators import GeneratorFactory
-from wikitextparser import Template
-
 from story.log_utils import logger
-from utils import scenario_character_name, dev_name_to_canonical_name, load_json, load_json_list, s
+from story.profiling import phase, count
+from utils import dev_name_to_canonical_name, load_json, load_json_list, s, read_json, \
+    json_cache, get_source_digest, LocalizeStore
+from wiki import scan_categories
 
 @cache
 def get_existing_sprites() -> dict[str, list[str]]:
     result_file = Path("cache/sprites.json")
     if not result_file.exists():
-        gen = GeneratorFactory(s)
-        gen.handle_args(['-cat:Character sprites', '-cat:Character sprite redirects', '-ns:File'])
-        gen = gen.getCombinedGenerator()
+        gen = scan_categories(['Character sprites', 'Character sprite redirects'], namespaces=[6], content=False,
+                              site=s)
         result: dict[str, list[str]] = {}
         for p in gen:
             title = p.title(with_ns=False, underscore=False)
@@ -25,7 +26,10 @@ def get_existing_sprites() -> dict[str, list[str]]:
             if name not in result:
                 result[name] = []
             result[name].append(num)
-        json.dump(result, open(result_file, "w", encoding="utf-8"), ensure_ascii=False, indent=4)
+        tmp = result_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+        tmp.replace(result_file)
     return json.load(open(result_file, "r", encoding="utf-8"))
 
 reported_missing_spines: set[str] = set()
@@ -35,109 +39,149 @@ def run_hash(string):
     from xxhash import xxh32
     return int(xxh32(string).intdigest())
 
-def get_scenario_character_id(text_ko_original: str) -> tuple[list[tuple[str, str, str, str]], int]:
-    result = []
-    speaker = None
-    if len(scenario_character_name) == 0:
-        path = Path("json/ScenarioCharacterNameExcelTable.json")
-        loaded = json.load(open(path, "r", encoding="utf-8"))
-        loaded = loaded['DataList']
-        for row in loaded:
-            cid = row['CharacterName']
-            scenario_character_name[cid] = row
-    # search_text = re.search(r"^\d+;([^;a-zA-Z]+) ?([a-zA-Z]+)?;\d+;?", text_ko)
-    for original in text_ko_original.split("\n"):
-        # deal with cases such as 3;사키;S2_11
-        search_text = re.search(r"^\d+;([^;]+);([S_\d]+);?", original)
-        if search_text is not None:
-            name_ko = search_text.group(1)
-            expression_number = search_text.group(2)
-            na = False
-        else:
-            search_text = re.search(r"#na;([^\n#;]+)(;.+)?", original)
-            if search_text is not None:
-                na = True
-                if search_text.group(2) is not None:
-                    name_ko = search_text.group(1)
-                else:
-                    result.append([None, None, None, None, None])
-                    continue
-                expression_number = None
-            else:
-                continue
 
-        # a -> A; b -> B
-        string_options = [name_ko, name_ko.upper(), name_ko.lower(), name_ko.encode('utf-8')]
-        for string in string_options:
-            hashed = run_hash(string)
-            if hashed in scenario_character_name:
-                break
+@dataclass(frozen=True, slots=True)
+class SpeakerRecord:
+    name: str
+    nickname: str
+    # canonical sprite name without the expression suffix; empty if the speaker has none
+    spine: str
+    portrait: str
+    spine_found: bool
+
+
+def resolve_speaker_row(row: dict) -> SpeakerRecord:
+    name = row['NameEN']
+    nickname = row['NicknameEN']
+    spine = row['SpinePrefabName'].split("/")[-1]
+    if spine is not None and spine.strip() != "":
+        spine = spine.replace("CharacterSpine_", "")
+        spine = dev_name_to_canonical_name(spine)
+    portrait = row['SmallPortrait'].split("/")[-1]
+    if portrait is not None and portrait != "":
+        if "Student_Portrait_" in portrait:
+            portrait = portrait.replace("Student_Portrait_", "")
+            portrait = dev_name_to_canonical_name(portrait)
+        elif "NPC_Portrait_" in portrait:
+            portrait = portrait.replace("NPC_Portrait_", "")
+            portrait = dev_name_to_canonical_name(portrait)
+
+    # Sometimes spine does not agree with portrait. In that case, use spine unless spine is empty but portrait
+    # is not.
+    if spine != portrait and spine.strip() == '' and portrait != '':
+        spine = portrait
+    existing_sprites = get_existing_sprites()
+    spine_found = True
+    if spine != "" and spine not in existing_sprites:
+        if (spine + " diorama") in existing_sprites:
+            spine += " diorama"
         else:
-            logger.warning(f"Cannot find scenario character name in table. Text: {name_ko}. Hash: {hashed}.")
-            continue
-        row = scenario_character_name[hashed]
-        name = row['NameEN']
-        nickname = row['NicknameEN']
-        spine = row['SpinePrefabName'].split("/")[-1]
-        if spine is not None and spine.strip() != "":
-            spine = spine.replace("CharacterSpine_", "")
-            spine = dev_name_to_canonical_name(spine)
-        portrait = row['SmallPortrait'].split("/")[-1]
-        if portrait is not None and portrait != "":
-            if "Student_Portrait_" in portrait:
-                portrait = portrait.replace("Student_Portrait_", "")
-                portrait = dev_name_to_canonical_name(portrait)
-            elif "NPC_Portrait_" in portrait:
-                portrait = portrait.replace("NPC_Portrait_", "")
-                portrait = dev_name_to_canonical_name(portrait)
-        if na:
-            spine, portrait = '', ''
-
-        # Sometimes spine does not agree with portrait. In that case, use spine unless spine is empty but portrait
-        # is not.
-        if spine != portrait and spine.strip() == '' and portrait != '':
-            spine = portrait
-        existing_sprites = get_existing_sprites()
-        if spine != "" and spine not in existing_sprites:
-            if (spine + " diorama") in existing_sprites:
-                spine += " diorama"
-            else:
-                if spine not in reported_missing_spines:
-                    logger.warning(f"Spine {spine} not found")
-                    reported_missing_spines.add(spine)
+            spine_found = False
+    return SpeakerRecord(name, nickname, spine, portrait, spine_found)
 
-        # deal with cases such as 3;사키;S2_11 and 3;히마리;S2
-        if expression_number is not None and "S" in expression_number:
-            match = re.search(r"(S\d?)_(\d\d)", expression_number)
+
+@cache
+def get_speaker_index() -> dict[int, SpeakerRecord]:
+    """Fully resolved speakers of ScenarioCharacterNameExcelTable, keyed by the xxh32 hash of their Korean name."""
+    loaded = read_json(Path("json/ScenarioCharacterNameExcelTable.json"))
+    return dict((row['CharacterName'], resolve_speaker_row(row)) for row in loaded['DataList'])
+
+
+@lru_cache(maxsize=4096)
+def find_speaker(name_ko: str) -> SpeakerRecord | None:
+    index = get_speaker_index()
+    # a -> A; b -> B. Hashing a str hashes its UTF-8 bytes, so the encoded variant needs no separate probe.
+    for string in (name_ko, name_ko.upper(), name_ko.lower()):
+        hashed = run_hash(string)
+        if hashed in index:
+            return index[hashed]
+    count("speaker_misses")
+    logger.warning(f"Cannot find scenario character name in table. Text: {name_ko}. Hash: {run_hash(name_ko)}.")
+    return None
+
+
+speaker_line_regex = re.compile(r"^\d+;([^;]+);([S_\d]+);?")
+speaker_text_regex = re.compile(r"^\d+;([^;]+);([S_\d]+);.")
+na_line_regex = re.compile(r"#na;([^\n#;]+)(;.+)?")
+
+
+@lru_cache(maxsize=16384)
+def parse_speaker_line(original: str) -> tuple[tuple, bool] | None:
+    """
+    Resolve one line of a ScriptKr string to a (name, nickname, spine, portrait, expression) tuple and whether that
+    character is the one speaking. Returns None for lines that do not mention a character.
+    """
+    # deal with cases such as 3;사키;S2_11
+    search_text = speaker_line_regex.search(original)
+    if search_text is not None:
+        name_ko = search_text.group(1)
+        expression_number = search_text.group(2)
+        na = False
+    else:
+        search_text = na_line_regex.search(original)
+        if search_text is None:
+            return None
+        if search_text.group(2) is None:
+            return (None, None, None, None, None), False
+        name_ko = search_text.group(1)
+        expression_number = None
+        na = True
+
+    record = find_speaker(name_ko)
+    if record is None:
+        return None
+    if na:
+        spine, portrait = '', ''
+    else:
+        spine, portrait = record.spine, record.portrait
+        if not record.spine_found and spine not in reported_missing_spines:
+            count("missing_spines")
+            logger.warning(f"Spine {spine} not found")
+            reported_missing_spines.add(spine)
+
+    # deal with cases such as 3;사키;S2_11 and 3;히마리;S2
+    if expression_number is not None and "S" in expression_number:
+        match = re.search(r"(S\d?)_(\d\d)", expression_number)
+        if match is not None:
+            spine_suffix, expression_number = match.groups()
+        else:
+            match = re.search(r"S\d+", expression_number)
             if match is not None:
-                spine_suffix, expression_number = match.groups()
+                spine_suffix = match.group(0)
+                expression_number = "00"
             else:
-                match = re.search(r"S\d+", expression_number)
-                if match is not None:
-                    spine_suffix = match.group(0)
-                    expression_number = "00"
-                else:
-                    raise RuntimeError(f"Spine {expression_number} cannot be parsed")
-            spine += " " + spine_suffix
-
-        if spine in existing_sprites and expression_number not in existing_sprites[spine]:
-            repl = existing_sprites[spine][0]
-            logger.debug(f"{spine}_{expression_number} does not exist. Replacing with {repl}.")
-            expression_number = repl
-
-        obj = (name, nickname, spine, portrait, expression_number)
-        # check if there is text after the last semicolon; if so, this is the speaker
-        if re.search(r"^\d+;([^;]+);([S_\d]+);.", original) is not None or na:
+                raise RuntimeError(f"Spine {expression_number} cannot be parsed")
+        spine += " " + spine_suffix
+
+    existing_sprites = get_existing_sprites()
+    if spine in existing_sprites and expression_number not in existing_sprites[spine]:
+        repl = existing_sprites[spine][0]
+        logger.debug(f"{spine}_{expression_number} does not exist. Replacing with {repl}.")
+        expression_number = repl
+
+    obj = (record.name, record.nickname, spine, portrait, expression_number)
+    # check if there is text after the last semicolon; if so, this is the speaker
+    return obj, na or speaker_text_regex.search(original) is not None
+
+
+def get_scenario_character_id(text_ko_original: str) -> tuple[list[tuple], tuple | None]:
+    result = []
+    speaker = None
+    for original in text_ko_original.split("\n"):
+        parsed = parse_speaker_line(original)
+        if parsed is None:
+            continue
+        obj, is_speaker = parsed
+        if is_speaker:
             speaker = obj
         result.append(obj)
     return result, speaker
 
 
 def get_main_scenarios() -> list[dict]:
-    with open ("json/ScenarioModeExcelTable.json", "r", encoding="utf-8") as f:
-        result = json.load(f)
-        result = result['DataList']
-        return [row for row in result if row['ModeType'] in {"Main", "SpecialOperation"}]
+    result = read_json(Path("json/ScenarioModeExcelTable.json"))
+    result = result['DataList']
+    return [row for row in result if row['ModeType'] in {"Main", "SpecialOperation"}]
 
 
 class StoryType(Enum):
@@ -149,17 +193,14 @@ class StoryType(Enum):
 
 
 def get_story_title_and_summary(query: int, story_type: StoryType) -> tuple[str, str]:
-    def process(loaded) -> dict[int, str]:
-        data_list = loaded['DataList']
-        result: dict[int, str] = {}
-        for row in data_list:
-            result[row['Key']] = row['En']
-        return result
+    def process(loaded) -> LocalizeStore:
+        return LocalizeStore(loaded['DataList'])
 
     data = load_json("LocalizeExcelTable.json", process)
     title_key = f"ScenarioDigest_Title_{query}"
     description_key = f"ScenarioDigest_Description_{query}"
-    return data.get(run_hash(title_key), None), data.get(run_hash(description_key), None)
+    title, summary = data.get_many([run_hash(title_key), run_hash(description_key)])
+    return title, summary
 
 
 def make_nav_span(event: dict) -> str:
@@ -209,26 +250,129 @@ def make_categories(start: list[str] = None, character_list: dict[str, int] = No
     return bgm_string + char_string + "\n".join(f"[[Category:{c}]]" for c in start)
 
 
-def get_events(pattern: str) -> dict:
-    def process(d: list[dict]) -> dict[int, list[dict]]:
-        result: dict[int, list[dict]] = {}
-        for loaded in d:
-            loaded = loaded['DataList']
-            for row in loaded:
-                group_id = row['GroupId']
-                if group_id not in result:
-                    result[group_id] = []
-                result[group_id].append(row)
-        return result
+@dataclass(slots=True)
+class ScenarioLine:
+    """The columns of a ScenarioScriptExcelTable row that the story parser reads."""
+    script_kr: str = ""
+    text_en: str = ""
+    sound: str = ""
+    selection_group: int = 0
+    bg_name: int = 0
+    bgm_id: int = 0
+    popup_file_name: str = ""
+    # marks the boundary between two scenario groups that make up one story
+    battle: bool = False
+
+    @staticmethod
+    def from_row(row: dict) -> "ScenarioLine":
+        return ScenarioLine(script_kr=row['ScriptKr'],
+                            text_en=row['TextEn'],
+                            sound=row['Sound'],
+                            selection_group=row['SelectionGroup'],
+                            bg_name=row['BGName'],
+                            bgm_id=row['BGMId'],
+                            popup_file_name=row['PopupFileName'],
+                            battle=row.get('Battle', False) == True)
+
+
+def group_events(d: list[dict]) -> dict[int, list[ScenarioLine]]:
+    result: dict[int, list[ScenarioLine]] = {}
+    for loaded in d:
+        loaded = loaded['DataList']
+        for row in loaded:
+            group_id = row['GroupId']
+            if group_id not in result:
+                result[group_id] = []
+            result[group_id].append(ScenarioLine.from_row(row))
+    return result
 
+
+def merge_events(parts: list[dict[int, list[ScenarioLine]]]) -> dict[int, list[ScenarioLine]]:
+    result: dict[int, list[ScenarioLine]] = {}
+    for part in parts:
+        for group_id, rows in part.items():
+            if group_id not in result:
+                result[group_id] = rows
+            else:
+                result[group_id].extend(rows)
+    return result
+
+
+def get_events(pattern: str, workers: int | None = None) -> dict:
     file_names = tuple(pattern.format(i) for i in range(1, 10))
-    e = load_json_list(file_names, process)
+    e = load_json_list(file_names, group_events, merge=merge_events, workers=workers)
     return e
 
 
-def get_story_event(query_group_id: int) -> list[dict] | None:
-    e = get_events("ScenarioScriptExcelTable{0}.json")
-    return e.get(query_group_id, None)
+scenario_pattern = "ScenarioScriptExcelTable{0}.json"
+scenario_index_dir = Path("cache/scenario_index")
+# bump whenever the format of the stored rows changes
+scenario_index_version = 2
+# the json_cache entries that rendering reads for every story, pinned while stories are rendered
+story_table_keys = ("LocalizeExcelTable.json", tuple(scenario_pattern.format(i) for i in range(1, 10)))
+
+
+def index_scenario_file(path: Path) -> tuple[Path, dict[int, tuple[int, int]]]:
+    """
+    Split a scenario shard into one pickle per GroupId, stored back to back in a data file next to an index of their
+    byte ranges. Both are named after the content hash of the shard and rebuilt when it changes. Generators running
+    at the same time may build the same index; each writes its own temporary files and moves them into place.
+    """
+    digest = get_source_digest(path)
+    prefix = f"{path.name}.{digest}.v{scenario_index_version}."
+    data_path = scenario_index_dir / f"{prefix}bin"
+    index_path = scenario_index_dir / f"{prefix}idx"
+    if not index_path.exists():
+        groups = group_events([read_json(path)])
+        scenario_index_dir.mkdir(parents=True, exist_ok=True)
+        for stale in scenario_index_dir.glob(f"{path.name}.*"):
+            if not stale.name.startswith(prefix):
+                stale.unlink(missing_ok=True)
+        index: dict[int, tuple[int, int]] = {}
+        data_tmp = scenario_index_dir / f"{prefix}bin.{os.getpid()}.tmp"
+        with open(data_tmp, "wb") as f:
+            for group_id, rows in groups.items():
+                start = f.tell()
+                pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+                index[group_id] = (start, f.tell() - start)
+        data_tmp.replace(data_path)
+        # written last so that an interrupted build is redone on the next run
+        index_tmp = scenario_index_dir / f"{prefix}idx.{os.getpid()}.tmp"
+        with open(index_tmp, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        index_tmp.replace(index_path)
+    with open(index_path, "rb") as f:
+        return data_path, pickle.load(f)
+
+
+@cache
+def get_scenario_index() -> dict[int, list[tuple[Path, int, int]]]:
+    result: dict[int, list[tuple[Path, int, int]]] = {}
+    for i in range(1, 10):
+        path = Path("json") / scenario_pattern.format(i)
+        if not path.exists():
+            continue
+        data_path, index = index_scenario_file(path)
+        for group_id, (offset, length) in index.items():
+            if group_id not in result:
+                result[group_id] = []
+            result[group_id].append((data_path, offset, length))
+    return result
+
+
+def get_story_event(query_group_id: int) -> list[ScenarioLine] | None:
+    # Reuse the fully decoded table if some other caller has already paid for it
+    if tuple(scenario_pattern.format(i) for i in range(1, 10)) in json_cache:
+        return get_events(scenario_pattern).get(query_group_id, None)
+    ranges = get_scenario_index().get(query_group_id, None)
+    if ranges is None:
+        return None
+    result = []
+    for data_path, offset, length in ranges:
+        with open(data_path, "rb") as f:
+            f.seek(offset)
+            result.extend(pickle.loads(f.read(length)))
+    return result
 
 
 @dataclass
@@ -239,6 +383,49 @@ class NavArgs:
     next_page: str = ""
 
 
+def format_nav(nav: str) -> str:
+    nav, _ = re.subn(r"(?<! )\|", " |", nav)
+    nav, _ = re.subn(r"\|(?! )", "| ", nav)
+    nav, _ = re.subn(r"(?<! )}}", " }}", nav)
+    return nav
+
+
+@dataclass(slots=True)
+class NavTemplate:
+    """
+    A navigation template call such as {{Story/StoryTop}} with named arguments in order. Arguments are set the way
+    wikitextparser's Template.set_arg sets them, without parsing the wikitext.
+    """
+    name: str
+    args: dict[str, str] = field(default_factory=dict)
+
+    def set_arg(self, k: str, v: str, before: str = None):
+        if before is None or k in self.args:
+            self.args[k] = v
+            return
+        items = list(self.args.items())
+        index = list(self.args).index(before)
+        self.args = dict(items[:index] + [(k, v)] + items[index:])
+
+    def __str__(self) -> str:
+        return "{{" + self.name + "".join(f"|{k}={v}" for k, v in self.args.items()) + "}}"
+
+    def render(self) -> str:
+        """Same as format_nav(str(self)): a space on both sides of each | and before the closing }}."""
+        if any("|" in k or "}" in k or k.startswith(" ") or "|" in v or "}" in v for k, v in self.args.items()):
+            return format_nav(str(self))
+        result = ["{{", self.name]
+        last = self.name
+        for k, v in self.args.items():
+            result.append("| " if last.endswith(" ") else " | ")
+            result.append(k)
+            result.append("=")
+            result.append(v)
+            last = v if v != "" else "="
+        result.append("}}" if last.endswith(" ") else " }}")
+        return "".join(result)
+
+
 @dataclass
 class StoryInfo:
     title: str
@@ -246,8 +433,8 @@ class StoryInfo:
     main_text: str
     category: str
     chars: dict[str, int]
-    nav_top: Template = field(default_factory=lambda: Template("{{Story/StoryTop}}"))
-    nav_bottom: Template = field(default_factory=lambda: Template("{{Story/StoryBottom}}"))
+    nav_top: NavTemplate = field(default_factory=lambda: NavTemplate("Story/StoryTop"))
+    nav_bottom: NavTemplate = field(default_factory=lambda: NavTemplate("Story/StoryBottom"))
 
     # FIXME: the before argument should be dropped
     def add_nav_arg(self, k: str, v: str, top_only: bool = False, before: str = None):
@@ -261,29 +448,25 @@ class StoryInfo:
 
     @cached_property
     def full_text(self):
-        def format_nav(nav: str) -> str:
-            nav, _ = re.subn(r"(?<! )\|", " |", nav)
-            nav, _ = re.subn(r"\|(?! )", "| ", nav)
-            nav, _ = re.subn(r"(?<! )}}", " }}", nav)
-            return nav
-
-        return "\n".join([
-            format_nav(str(self.nav_top)),
-            self.main_text,
-            format_nav(str(self.nav_bottom)),
-            self.category
-        ])
+        with phase("nav"):
+            return "\n".join([
+                self.nav_top.render(),
+                self.main_text,
+                self.nav_bottom.render(),
+                self.category
+            ])
 
 
 def make_story_nav(story: StoryInfo,
                    nav_args: NavArgs):
     args = asdict(nav_args)
     # FIXME: don't fix ordering
-    for k in ['next_title', 'next_page', 'prev_title', 'prev_page']:
-        v = args[k]
-        if v == "":
-            continue
-        story.add_nav_arg(k, v, before="title")
+    with phase("nav"):
+        for k in ['next_title', 'next_page', 'prev_title', 'prev_page']:
+            v = args[k]
+            if v == "":
+                continue
+            story.add_nav_arg(k, v, before="title")
 
 
 def make_story_list_nav(stories: list[StoryInfo], page_prefix: str):
@@ -0,0 +1,236 @@
+"""
+Run the weekly refresh as a graph of jobs.
+
+    python tasks.py [JOB ...] [--jobs N] [--force] [--list]
+
+Every job declares the tables in json/ and the wiki categories and pages it reads. A job starts as soon as the jobs it
+comes after have finished, up to N at a time, and is skipped when none of its inputs (nor the code) changed since its
+last successful run, which is kept in cache/tasks.json. The output of each job goes to cache/tasks/<job>.log, and a
+timing summary is printed at the end. Jobs that edit the wiki share the edit rate (see edit_scheduler.py) between
+them.
+
+Naming jobs runs only those; the jobs they come after are not run for them.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from pywikibot import config
+from xxhash import xxh3_64, xxh3_64_hexdigest
+
+from wiki import Site, Page, offline, category_revisions
+
+state_path = Path("cache/tasks.json")
+log_dir = Path("cache/tasks")
+root = Path(__file__).parent.absolute()
+python = sys.executable
+
+
+@dataclass
+class Job:
+    name: str
+    command: list[str]
+    # glob patterns of the files in json/ that the job reads
+    tables: list[str] = field(default_factory=list)
+    categories: list[str] = field(default_factory=list)
+    pages: list[str] = field(default_factory=list)
+    after: list[str] = field(default_factory=list)
+    edits: bool = True
+    # inputs that cannot be fingerprinted, like the files update.py downloads
+    always: bool = False
+
+
+story_tables = ["ScenarioScriptExcelTable*.json", "ScenarioModeExcelTable.json", "ScenarioCharacterNameExcelTable.json",
+                "ScenarioBGName*.json", "BGMExcelTable.json", "LocalizeExcelTable.json", "devname_map*.json"]
+
+jobs = [
+    Job("update", [python, str(root / "update.py")], edits=False, always=True),
+    # the only job that writes cache/char_id.pickle; the jobs that read it come after it
+    Job("character_table",
+        [python, "-c", "from utils import get_character_table; get_character_table(incremental=True)"],
+        edits=False, always=True),
+    Job("momotalk", [python, str(root / "momotalk.py")],
+        tables=["AcademyMessangerExcelTable.json", "AcademyFavorScheduleExcelTable.json", "LocalizeExcelTable.json"],
+        categories=["Characters"], after=["update", "character_table"]),
+    Job("character_infobox", [python, "-m", "scripts.character_infobox"],
+        categories=["Characters galleries", "Characters"], after=["update"]),
+    Job("music_info", [python, "-m", "scripts.make_music_info"], pages=["Music"], after=["update"]),
+    Job("main_story", [python, "-m", "story.main_story"], tables=story_tables, pages=["Music"], after=["update"]),
+    Job("event_story", [python, "-m", "story.event_story"],
+        tables=story_tables + ["EventContentScenarioExcelTable.json"], categories=["Events"], pages=["Music"],
+        after=["update"]),
+    Job("side_story", [python, "-m", "story.side_story"], tables=story_tables + ["glossary.py"], pages=["Music"],
+        after=["update"]),
+    Job("relationship_story", [python, "-m", "story.relationship_story"],
+        tables=story_tables + ["AcademyFavorScheduleExcelTable.json"], categories=["Characters"], pages=["Music"],
+        after=["update", "character_table"]),
+]
+
+
+def file_digest(path: Path) -> str:
+    digest = xxh3_64()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_paths() -> list[Path]:
+    """The bot's own source files, without virtual environments and other untracked code."""
+    try:
+        listed = subprocess.run(["git", "ls-files", "-z", "*.py"], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.split("\0")
+        paths = [root / name for name in listed if name != ""]
+    except (OSError, subprocess.CalledProcessError):
+        # not a git checkout
+        paths = [p for p in root.rglob("*.py")
+                 if not any(part.startswith(".") or part in ("venv", "cache") for part in p.relative_to(root).parts)]
+    return sorted(p for p in paths if "benchmarks" not in p.relative_to(root).parts and p.exists())
+
+
+def code_digest() -> str:
+    return xxh3_64_hexdigest("".join(f"{p.relative_to(root)}:{file_digest(p)}" for p in code_paths()))
+
+
+class Fingerprints:
+    """Digests of the inputs of the jobs. Wiki inputs are read once, before any job has edited the wiki."""
+
+    def __init__(self):
+        self.code = code_digest()
+        self.wiki: dict[str, str] = {}
+
+    def read_wiki(self, selected: list[Job]):
+        site = Site()
+        for category in sorted(set(c for job in selected for c in job.categories)):
+            revisions = category_revisions(category, site=site)
+            self.wiki[f"Category:{category}"] = xxh3_64_hexdigest(json.dumps(sorted(revisions.items())))
+        titles = sorted(set(p for job in selected for p in job.pages))
+        for page in site.preloadpages([Page(site, title) for title in titles], content=False):
+            self.wiki[page.title()] = str(page.latest_revision_id if page.exists() else 0)
+
+    def of(self, job: Job) -> str:
+        inputs = {"code": self.code, "command": [Path(arg).name for arg in job.command[1:]]}
+        for pattern in job.tables:
+            for path in sorted(Path("json").glob(pattern)):
+                inputs[str(path)] = file_digest(path)
+        for category in job.categories:
+            inputs[f"Category:{category}"] = self.wiki[f"Category:{category}"]
+        for title in job.pages:
+            inputs[title] = self.wiki[Page(Site(), title).title()]
+        return xxh3_64_hexdigest(json.dumps(inputs, sort_keys=True))
+
+
+def load_state() -> dict[str, dict]:
+    if state_path.exists():
+        return json.load(open(state_path, "r", encoding="utf-8"))
+    return {}
+
+
+def write_state(state: dict[str, dict]):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = state_path.with_suffix(f".{os.getpid()}.tmp")
+    json.dump(state, open(tmp, "w", encoding="utf-8"), indent=4)
+    tmp.replace(state_path)
+
+
+def run_job(job: Job, env: dict[str, str]) -> int:
+    log_dir.mkdir(parents=True, exist_ok=True)
+    with open(log_dir / f"{job.name}.log", "w", encoding="utf-8") as log:
+        return subprocess.run(job.command, stdout=log, stderr=subprocess.STDOUT, env=env).returncode
+
+
+def job_env(job: Job, editing_jobs: int) -> dict[str, str]:
+    env = dict(os.environ)
+    # for python -m when the data is not in the repository
+    env["PYTHONPATH"] = os.pathsep.join([str(root)] + [p for p in [os.environ.get("PYTHONPATH", "")] if p != ""])
+    if not job.edits or editing_jobs <= 1 or (offline and "BA_EDIT_RATE" not in os.environ):
+        return env
+    total = float(os.environ.get("BA_EDIT_RATE", 60 / max(config.put_throttle, 1)))
+    env["BA_EDIT_RATE"] = str(total / editing_jobs)
+    return env
+
+
+def run(selected: list[Job], parallel: int, force: bool) -> dict[str, tuple[str, float]]:
+    """Returns job name -> (status, seconds)."""
+    names = set(job.name for job in selected)
+    state = load_state()
+    fingerprints = Fingerprints()
+    fingerprints.read_wiki(selected)
+    editing_jobs = min(parallel, sum(1 for job in selected if job.edits))
+    results: dict[str, tuple[str, float]] = {}
+    waiting = list(selected)
+    running: dict[Future, tuple[Job, str, float]] = {}
+    with ThreadPoolExecutor(parallel) as executor:
+        while len(waiting) > 0 or len(running) > 0:
+            for job in list(waiting):
+                dependencies = [name for name in job.after if name in names]
+                if any(results.get(name, ("",))[0] in ("failed", "blocked") for name in dependencies):
+                    waiting.remove(job)
+                    results[job.name] = ("blocked", 0.0)
+                    print(f"{job.name}: blocked")
+                    continue
+                if not all(name in results for name in dependencies):
+                    continue
+                waiting.remove(job)
+                fingerprint = fingerprints.of(job)
+                if not force and not job.always and state.get(job.name, {}).get("fingerprint", None) == fingerprint:
+                    results[job.name] = ("skipped", 0.0)
+                    print(f"{job.name}: skipped, inputs unchanged")
+                    continue
+                print(f"{job.name}: started")
+                running[executor.submit(run_job, job, job_env(job, editing_jobs))] = (job, fingerprint,
+                                                                                       time.perf_counter())
+            if len(running) == 0:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, fingerprint, start = running.pop(future)
+                seconds = time.perf_counter() - start
+                if future.result() == 0:
+                    results[job.name] = ("ran", seconds)
+                    state[job.name] = {"fingerprint": fingerprint, "finished": time.time(), "seconds": seconds}
+                    write_state(state)
+                else:
+                    results[job.name] = ("failed", seconds)
+                print(f"{job.name}: {results[job.name][0]} in {seconds:.1f} s, see {log_dir / job.name}.log")
+    return results
+
+
+def print_summary(results: dict[str, tuple[str, float]], wall_time: float):
+    print(f"\n{'job':<24}{'status':<10}{'seconds':>10}")
+    for name, (status, seconds) in results.items():
+        print(f"{name:<24}{status:<10}{seconds:>10.1f}")
+    print(f"Wall time {wall_time:.1f} s, {sum(s for _, s in results.values()):.1f} s of jobs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", metavar="JOB")
+    parser.add_argument("--jobs", type=int, default=4, help="how many jobs to run at the same time")
+    parser.add_argument("--force", action="store_true", help="run jobs even if their inputs are unchanged")
+    parser.add_argument("--list", action="store_true", help="list the jobs and what they read")
+    args = parser.parse_args()
+
+    if args.list:
+        for job in jobs:
+            print(f"{job.name}: after {job.after}, tables {job.tables}, categories {job.categories}, pages {job.pages}")
+        return
+    unknown = set(args.names) - set(job.name for job in jobs)
+    if len(unknown) > 0:
+        parser.error(f"unknown jobs: {', '.join(sorted(unknown))}")
+    selected = [job for job in jobs if len(args.names) == 0 or job.name in args.names]
+    start = time.perf_counter()
+    results = run(selected, args.jobs, args.force)
+    print_summary(results, time.perf_counter() - start)
+    if any(status in ("failed", "blocked") for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
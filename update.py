@@ -1,6 +1,8 @@
 from pathlib import Path
 import requests
 
+from snapshots import compile_json_tables
+
 
 def download(base: str, files: list[str]):
     for f in files:
@@ -51,3 +53,4 @@ Path("json").mkdir(exist_ok=True)
 excel_download()
 db_download()
 wiki_repo_download()
+compile_json_tables()
@@ -1,3 +1 @@
-python ./update.py
-python ./momotalk.py
-python ./character_infobox.py
\ No newline at end of file
+python ./tasks.py "$@"
@@ -1,13 +1,15 @@
 import re
 import sys
+from concurrent.futures import Future
+from functools import partial
 from pathlib import Path
 from typing import Callable
 
-import pywikibot as pwb
-from pywikibot.page import FilePage
-from pywikibot.pagegenerators import PreloadingGenerator
+from edit_scheduler import edit_scheduler, EditPriority
+from utils import file_digest, journal_done, journal_record, journaled_run
+from wiki import Site, FilePage, PreloadingGenerator
 
-s = pwb.Site()
+s = Site()
 s.login()
 upload_path = Path("./upload")
 
@@ -17,7 +19,8 @@ def upload_cut_scenes(image_path: Path) -> None:
         def name_filter(f: str) -> bool:
             return re.search(r"_(kr|tw|th)\.jpg", f, re.IGNORECASE) is None
 
-        return [f for f in image_path.rglob("*.jpg") if name_filter(f.name)]
+        files = [f for f in image_path.rglob("*.jpg") if name_filter(f.name)]
+        return [f for f in files if not journal_done("File:" + f.name, file_digest(f))]
 
     already_exist = set()
     gen = (FilePage(s, "File:" + f.name) for f in glob())
@@ -27,8 +30,11 @@ def upload_cut_scenes(image_path: Path) -> None:
         if p.exists():
             already_exist.add(p.title(underscore=True, with_ns=False))
     for f in glob():
+        title = "File:" + f.name
         if f.name in already_exist:
+            journal_record("upload", title, file_digest(f), "skipped")
             continue
+        journal_record("upload", title, file_digest(f), "planned")
         is_cut_scene = False
         if f.name.startswith("BG_CS"):
             is_cut_scene = True
@@ -42,10 +48,19 @@ def upload_cut_scenes(image_path: Path) -> None:
             s.upload(FilePage(s, "File:" + f.name), source_filename=str(f),
                      comment="Batch upload background images and cutscenes",
                      text=cat)
+            journal_record("upload", title, file_digest(f), "saved")
         except Exception as e:
+            journal_record("upload", title, file_digest(f), "failed", str(e))
             print(f.name, e)
 
 
+def finish_redirect(title: str, digest: str, future: Future):
+    if future.exception() is not None:
+        journal_record("upload", title, digest, "failed", str(future.exception()))
+        return
+    journal_record("upload", title, digest, "saved")
+
+
 def upload_files(extensions: tuple[str, ...],
                  path: Path,
                  text: str,
@@ -61,7 +76,9 @@ def upload_files(extensions: tuple[str, ...],
         result = []
         for e in extensions:
             result.extend(path.rglob(f"*.{e}"))
-        return [f for f in result if file_name_filter(f.name)]
+        result = [f for f in result if file_name_filter(f.name)]
+        # leave out the files completed by the run being resumed
+        return [f for f in result if not journal_done("File:" + name_mapper(f.name), file_digest(f))]
 
     file_list = get_all_files()
     print(f"{len(file_list)} files found")
@@ -76,14 +93,20 @@ def upload_files(extensions: tuple[str, ...],
             already_exist.add(p.title(underscore=True, with_ns=False))
             exists_count += 1
     print(exists_count, "files already exist")
+    redirects: list[Future] = []
     for f in file_list:
+        title = "File:" + name_mapper(f.name)
         if name_mapper(f.name) in already_exist:
+            journal_record("upload", title, file_digest(f), "skipped")
             continue
+        journal_record("upload", title, file_digest(f), "planned")
         try:
             s.upload(FilePage(s, "File:" + name_mapper(f.name)), source_filename=str(f), comment=comment,
                      text=text)
+            journal_record("upload", title, file_digest(f), "saved")
         except Exception as e:
             if not redirect:
+                journal_record("upload", title, file_digest(f), "failed", str(e))
                 continue
             error_string = str(e)
             search = re.search(r"duplicate of \['([^']+)'", error_string)
@@ -91,10 +114,14 @@ def upload_files(extensions: tuple[str, ...],
                 search = re.search(r'duplicate of \["([^"]+)"', error_string)
             if search is not None:
                 p = FilePage(s, "File:" + name_mapper(f.name))
-                p.text = f"#REDIRECT [[File:{search.group(1)}]]"
-                p.save(summary="Redirect to existing file")
+                future = edit_scheduler(s).submit(p, f"#REDIRECT [[File:{search.group(1)}]]",
+                                                  "Redirect to existing file", priority=EditPriority.CREATE)
+                future.add_done_callback(partial(finish_redirect, title, file_digest(f)))
+                redirects.append(future)
             else:
+                journal_record("upload", title, file_digest(f), "failed", str(e))
                 print(f.name, "\n", e)
+    edit_scheduler(s).finish(redirects)
 
 
 def upload_bgm(path: Path):
@@ -164,7 +191,8 @@ def rename_files(path: Path):
 
 
 def main():
-    upload_story()
+    with journaled_run("upload"):
+        upload_story()
 
 
 if __name__ == "__main__":
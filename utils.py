@@ -1,15 +1,29 @@
+import atexit
 import dataclasses
+import os
 import pickle
 import re
-from collections.abc import Callable
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Hashable
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from functools import cache
+from functools import cache, partial, wraps
+from itertools import islice, repeat
 from pathlib import Path
 from typing import Any
 
-from pywikibot import Page, Site
-from pywikibot.pagegenerators import GeneratorFactory
 from wikitextparser import parse, WikiText, Template
+from xxhash import xxh3_64_hexdigest
+
+from edit_scheduler import edit_scheduler, EditPriority
+from snapshots import get_source_digest, compile_json, compile_json_tables, read_json, file_lock
+from wiki import Page, Site, offline, category_revisions, fetch_lead_sections
 
 import json
 
@@ -17,58 +31,353 @@ import json
 s = Site()
 
 
-json_cache: dict[str | tuple[str, ...], Any] = {}
+def approximate_size(obj: Any, sample: int = 32) -> int:
+    """
+    Estimate the memory held by a decoded table. Only the first few items of each container are measured and the
+    result is extrapolated, so this stays cheap for tables with hundreds of thousands of rows.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, array)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        items = list(islice(obj.items(), sample))
+        measured = sum(approximate_size(k, sample) + approximate_size(v, sample) for k, v in items)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = list(islice(obj, sample))
+        measured = sum(approximate_size(item, sample) for item in items)
+    elif hasattr(obj, "__dict__"):
+        return size + approximate_size(vars(obj), sample)
+    elif hasattr(obj, "__slots__"):
+        return size + sum(approximate_size(getattr(obj, name, None), sample) for name in obj.__slots__)
+    else:
+        return size
+    if len(items) == 0:
+        return size
+    return size + measured * len(obj) // len(items)
+
+
+class JsonCache:
+    """
+    LRU cache of decoded tables with an approximate memory budget in bytes. Pinned entries are never evicted, so a
+    phase can keep the tables it is actively using while older ones are dropped.
+    """
+
+    def __init__(self, budget: int | None = None):
+        self.budget = budget
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.pins: dict[Hashable, int] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value, _ = self.entries[key]
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def put[T](self, key: Hashable, value: T, size: int | None = None) -> T:
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        if size is None:
+            size = approximate_size(value)
+        self.entries[key] = (value, size)
+        self.size += size
+        self.misses += 1
+        self.evict()
+        return value
+
+    def evict(self):
+        if self.budget is None:
+            return
+        for key in list(self.entries.keys())[:-1]:
+            if self.size <= self.budget:
+                break
+            if self.pins.get(key, 0) > 0:
+                continue
+            self.size -= self.entries.pop(key)[1]
+            self.evictions += 1
 
+    def pin(self, key: Hashable):
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key: Hashable):
+        count = self.pins.get(key, 0) - 1
+        if count > 0:
+            self.pins[key] = count
+        else:
+            self.pins.pop(key, None)
+            self.evict()
+
+    @contextmanager
+    def pinned(self, *keys: Hashable):
+        for key in keys:
+            self.pin(key)
+        try:
+            yield
+        finally:
+            for key in keys:
+                self.unpin(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, int | None]:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def get_cache_budget() -> int | None:
+    """Memory budget of json_cache from BA_CACHE_BUDGET_MB; unset or 0 means unbounded."""
+    budget = int(os.environ.get("BA_CACHE_BUDGET_MB", "0"))
+    return budget * 1024 * 1024 if budget > 0 else None
+
+
+json_cache = JsonCache(get_cache_budget())
+
+
+def print_cache_stats():
+    stats = json_cache.stats()
+    budget = f"{stats['budget'] / 1024 / 1024:.0f} MB" if stats['budget'] is not None else "unbounded"
+    print(f"json_cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+          f"{stats['entries']} entries, {stats['size'] / 1024 / 1024:.1f} MB of {budget}")
 
-def load_json[T](file_name: str, processor: Callable[[dict], T] = lambda x: x) -> T | None:
-    if file_name not in json_cache:
-        path = Path("json") / file_name
-        if not path.exists():
-            return None
-        with open(path, "r", encoding="utf-8") as f:
-            json_cache[file_name] = processor(json.load(f))
-    return json_cache[file_name]
 
+if json_cache.budget is not None:
+    atexit.register(print_cache_stats)
 
-def load_json_list[T](files: tuple[str, ...], processor: Callable[[list[dict]], T]) -> T:
-    if files not in json_cache:
-        json_dicts = []
-        for f in files:
-            p = Path("json") / f
-            if p.exists():
-                json_dicts.append(json.load(open(p, "r", encoding="utf-8")))
-        json_cache[files] = processor(json_dicts)
-    return json_cache[files]
+
+def cached_table[T](func: Callable[[], T]) -> Callable[[], T]:
+    """
+    Like functools.cache for argument-less table loaders, but accounted for and evictable in json_cache. The key of
+    the entry is the cache_key attribute of the returned function, for pinning.
+    """
+    key = f"{func.__name__}()"
+
+    @wraps(func)
+    def wrapper() -> T:
+        if key in json_cache:
+            return json_cache[key]
+        return json_cache.put(key, func())
+
+    wrapper.cache_key = key
+    return wrapper
+
+
+def load_json[T](file_name: str, processor: Callable[[dict], T] = lambda x: x) -> T | None:
+    if file_name in json_cache:
+        return json_cache[file_name]
+    path = Path("json") / file_name
+    if not path.exists():
+        return None
+    return json_cache.put(file_name, processor(read_json(path)))
+
+
+def get_worker_count() -> int:
+    """Number of worker processes from BA_WORKERS, defaulting to the number of CPUs."""
+    return int(os.environ.get("BA_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def process_json_file[T](path: Path, processor: Callable[[list[dict]], T]) -> T:
+    return processor([read_json(path)])
+
+
+def load_json_list[T](files: tuple[str, ...], processor: Callable[[list[dict]], T],
+                      merge: Callable[[list[T]], T] | None = None, workers: int | None = None) -> T:
+    """
+    Load several tables and combine them with processor. If merge is given, each file is decoded and processed on
+    its own in a process pool and merge combines the per-file results in file order; this must give the same result
+    as calling processor on all files at once. processor and merge must then be picklable module-level functions.
+    """
+    if files in json_cache:
+        return json_cache[files]
+    paths = [Path("json") / f for f in files if (Path("json") / f).exists()]
+    if workers is None:
+        workers = get_worker_count()
+    if merge is not None and workers > 1 and len(paths) > 1:
+        # hash in this process so that workers find an up-to-date snapshot index instead of racing to write it
+        for p in paths:
+            get_source_digest(p)
+        with ProcessPoolExecutor(min(workers, len(paths))) as pool:
+            parts = list(pool.map(process_json_file, paths, repeat(processor)))
+        return json_cache.put(files, merge(parts))
+    json_dicts = [read_json(p) for p in paths]
+    return json_cache.put(files, processor(json_dicts))
+
+
+class LocalizeStore:
+    """
+    Localized strings of LocalizeExcelTable, stored as a sorted array of the uint32 key hashes and offsets into a
+    single UTF-8 blob instead of a dict of Python strings.
+    """
+
+    def __init__(self, rows: list[dict], language: str = "En"):
+        self.hashes = array("I")
+        self.offsets = array("I", [0])
+        self.nulls: set[int] = set()
+        blob = bytearray()
+        # sorted() is stable, so for duplicated keys the last row wins just like it would in a dict
+        for row in sorted(rows, key=lambda r: r['Key']):
+            key_hash = row['Key']
+            value = row[language]
+            if len(self.hashes) > 0 and self.hashes[-1] == key_hash:
+                self.offsets.pop()
+                del blob[self.offsets[-1]:]
+            else:
+                self.hashes.append(key_hash)
+            if value is None:
+                self.nulls.add(key_hash)
+            else:
+                self.nulls.discard(key_hash)
+                blob += value.encode("utf-8")
+            self.offsets.append(len(blob))
+        self.blob = bytes(blob)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _value(self, index: int) -> str | None:
+        if self.hashes[index] in self.nulls:
+            return None
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def get(self, key_hash: int, default: str | None = None) -> str | None:
+        index = bisect_left(self.hashes, key_hash)
+        if index == len(self.hashes) or self.hashes[index] != key_hash:
+            return default
+        return self._value(index)
+
+    def get_many(self, key_hashes: Iterable[int], default: str | None = None) -> list[str | None]:
+        """Resolve many hashes at once; queries are sorted so each search starts where the previous one ended."""
+        key_hashes = list(key_hashes)
+        result: list[str | None] = [default] * len(key_hashes)
+        low = 0
+        for position in sorted(range(len(key_hashes)), key=key_hashes.__getitem__):
+            key_hash = key_hashes[position]
+            low = bisect_left(self.hashes, key_hash, low)
+            if low < len(self.hashes) and self.hashes[low] == key_hash:
+                result[position] = self._value(low)
+        return result
 
 
 def normalize_char_name(original: str) -> str:
     return re.sub(r" ?\(.+\)", "", original)
 
 
-def get_character_table(use_cache: bool = True) -> dict[int, str]:
-    path = Path("cache/char_id.pickle")
-    if path.exists() and use_cache:
-        result = pickle.load(open(path, "rb"))
-    else:
-        path.parent.mkdir(exist_ok=True)
-        gen = GeneratorFactory(s)
-        gen.handle_args(["-cat:Characters"])
-        gen = gen.getCombinedGenerator(preload=True)
-        result = {}
-        for p in gen:
-            char_id = int(re.search(r"Id *= *([0-9]+)", p.text).group(1))
-            char_name = re.search(r"\| *(Wiki)?[Nn]ame *= *(?P<name>[^\n]+)", p.text).group("name")
-            result[char_id] = char_name
-        pickle.dump(result, open(path, "wb"))
-    return result
+character_table_path = Path("cache/char_id.pickle")
 
 
-@cache
+@dataclass
+class CharacterTable:
+    # page title -> (revision id the page was read at, character id, character name)
+    pages: dict[str, tuple[int, int, str]] = dataclasses.field(default_factory=dict)
+    # time of the last sync with the wiki
+    synced: float = 0.0
+
+    @property
+    def ids(self) -> dict[int, str]:
+        return dict((char_id, char_name) for _, char_id, char_name in self.pages.values())
+
+
+@dataclass(frozen=True, slots=True)
+class CharacterRecord:
+    title: str
+    revision: int
+    id: int
+    name: str
+
+
+def read_character_page(p: Page) -> CharacterRecord:
+    char_id = int(re.search(r"Id *= *([0-9]+)", p.text).group(1))
+    char_name = re.search(r"\| *(Wiki)?[Nn]ame *= *(?P<name>[^\n]+)", p.text).group("name")
+    return CharacterRecord(p.title(), p.latest_revision_id, char_id, char_name)
+
+
+def fetch_character_records(titles: list[str]) -> list[CharacterRecord]:
+    """
+    Id and name from the {{Character}} infobox of each page, downloading only the lead sections. Pages whose lead
+    section does not have them are read in full and searched like before.
+    """
+    records: dict[str, CharacterRecord] = {}
+    incomplete: list[Page] = []
+    for title, (revision, lead) in fetch_lead_sections(titles, site=s).items():
+        args = extract_template_args(lead, "Character") or {}
+        char_name = next((v for k, v in args.items() if re.fullmatch(r"(Wiki)?[Nn]ame", k)), "")
+        if not args.get("Id", "").isdigit() or char_name == "":
+            incomplete.append(Page(s, title))
+            continue
+        records[title] = CharacterRecord(title, revision, int(args['Id']), char_name)
+    for p in s.preloadpages(incomplete):
+        records[p.title()] = read_character_page(p)
+    return [records[title] for title in titles if title in records]
+
+
+def load_character_table() -> CharacterTable | None:
+    if not character_table_path.exists():
+        return None
+    loaded = pickle.load(open(character_table_path, "rb"))
+    if isinstance(loaded, dict):
+        # an id -> name table written before revisions were kept; the next sync reads every page again
+        return CharacterTable(dict((name, (0, char_id, name)) for char_id, name in loaded.items()))
+    return loaded
+
+
+def sync_character_table(table: CharacterTable) -> CharacterTable:
+    """Download only the pages of Category:Characters that were created or edited since the table was synced."""
+    revisions = category_revisions("Characters", site=s)
+    if len(revisions) == 0 and len(table.pages) > 0:
+        # more likely a wiki or configuration problem than every character page being gone
+        raise ValueError(f"Category:Characters is empty on {s}, keeping the {len(table.pages)} characters of the "
+                         f"last sync")
+    changed = [title for title, revision in revisions.items()
+               if title not in table.pages or table.pages[title][0] != revision]
+    loaded = dict((r.title, (r.revision, r.id, r.name)) for r in fetch_character_records(changed))
+    pages = dict((title, loaded[title] if title in loaded else table.pages[title]) for title in revisions
+                 if title in loaded or title in table.pages)
+    last_sync = time.strftime('%Y-%m-%d %H:%M', time.localtime(table.synced)) if table.synced > 0 else "never"
+    print(f"Character table: {len(changed)} of {len(pages)} pages read, "
+          f"{len(table.pages.keys() - pages.keys())} removed since the last sync ({last_sync})")
+    return CharacterTable(pages, time.time())
+
+
+def get_character_table(use_cache: bool = True, incremental: bool = False) -> dict[int, str]:
+    """
+    Character id -> name, from the pages in Category:Characters. With use_cache the table from the last time is used
+    as it is, with incremental it is patched with the pages that changed since then, otherwise every page is read.
+    """
+    table = load_character_table()
+    if table is not None and use_cache and not incremental:
+        return table.ids
+    table = sync_character_table(table if incremental and table is not None else CharacterTable())
+    character_table_path.parent.mkdir(exist_ok=True)
+    # other generators may be reading it
+    tmp = character_table_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(table, f)
+    tmp.replace(character_table_path)
+    return table.ids
+
+
+@cached_table
 def get_dev_name_map() -> dict[str, str]:
     dev_name_map: dict[str, str] = {}
 
     def read_dev_name_map(fname: str):
-        name_map = json.load(open(fname, "r", encoding="utf-8"))
+        name_map = read_json(Path(fname))
         for k, v in name_map.items():
             wiki_name = v['firstname']
             if v['variant'] is not None:
@@ -115,7 +424,7 @@ def get_localized_club_name(name: str):
     raise ValueError(name)
 
 
-@cache
+@cached_table
 def load_momotalk() -> dict[int, list[dict]]:
     result = {}
     momotalk = load_json(f"AcademyMessangerExcelTable.json")
@@ -129,7 +438,7 @@ def load_momotalk() -> dict[int, list[dict]]:
     return result
 
 
-@cache
+@cached_table
 def load_favor_schedule() -> dict[int, list[dict]]:
     favor_schedule = {}
     loaded = load_json("AcademyFavorScheduleExcelTable.json")
@@ -142,14 +451,12 @@ def load_favor_schedule() -> dict[int, list[dict]]:
     return favor_schedule
 
 
-scenario_character_name: dict[int, dict] = {}
-
 background_file_name: dict[int, str] = {}
 
 
 def get_background_file_name(background_id: int) -> str | None:
     if len(background_file_name) == 0:
-        loaded = json.load(open("json/ScenarioBGNameExcelTable.json", "r", encoding="utf-8"))
+        loaded = read_json(Path("json/ScenarioBGNameExcelTable.json"))
         loaded = loaded['DataList']
         for row in loaded:
             bg_id = row['Name']
@@ -172,14 +479,14 @@ class BGMInfo:
 bgm_file_info: dict[int, BGMInfo] = {}
 
 
-def get_bgm_file_info(query_id: int) -> BGMInfo:
+def load_bgm_file_info() -> dict[int, BGMInfo]:
     def list_or_none(l: list) -> str | None:
         if len(l) == 0:
             return None
         return l[0]
-    
+
     if len(bgm_file_info) == 0:
-        loaded = json.load(open("json/BGMExcelTable.json", "r", encoding="utf-8"))
+        loaded = read_json(Path("json/BGMExcelTable.json"))
         loaded = loaded['DataList']
         for row in loaded:
             bgm_id = row['Id']
@@ -192,6 +499,11 @@ def get_bgm_file_info(query_id: int) -> BGMInfo:
             info_list = [loop_start, loop_end, volume, transition_time, offset_time]
             info_list = [None if x is None else float(x) for x in info_list]
             bgm_file_info[bgm_id] = BGMInfo(bgm_id, bgm_name, *info_list)
+    return bgm_file_info
+
+
+def get_bgm_file_info(query_id: int) -> BGMInfo:
+    load_bgm_file_info()
     if query_id in bgm_file_info:
         return bgm_file_info[query_id]
     raise RuntimeError(f"Bgm with id {query_id} not found.")
@@ -262,14 +574,339 @@ def find_template(w: WikiText, name: str) -> Template | None:
     return None
 
 
+template_token_regex = re.compile(r"\{\{\{|}}}|\{\{|}}|\[\[|]]|\|")
+closing_tokens = {"{{{": "}}}", "{{": "}}", "[[": "]]"}
+
+
+def extract_template_args(text: str, name: str) -> dict[str, str] | None:
+    """
+    The stripped arguments of the first {{name}} in text, found without parsing the rest of the page. Positional
+    arguments are keyed "1", "2", ... as in wikitextparser. None if there is no such template.
+    """
+    name_pattern = "[ _]+".join(re.escape(part) for part in name.split())
+    start = re.search(r"\{\{\s*" + name_pattern + r"\s*(?=[|}])", text, re.IGNORECASE)
+    if start is None:
+        return None
+    parts: list[str] = []
+    # brackets opened inside the template and not closed yet
+    opened: list[str] = []
+    part_start = start.end()
+    position = start.end()
+    while (token := template_token_regex.search(text, position)) is not None:
+        kind = token.group()
+        position = token.end()
+        if kind == "}}}" and (len(opened) == 0 or opened[-1] == "{{"):
+            # }} followed by a }, as in {{name|a={{b}}}}
+            kind = "}}"
+            position -= 1
+        if kind in closing_tokens:
+            opened.append(kind)
+        elif kind == "|":
+            if len(opened) == 0:
+                parts.append(text[part_start:token.start()])
+                part_start = position
+        elif len(opened) > 0:
+            if closing_tokens[opened[-1]] == kind:
+                opened.pop()
+        elif kind == "}}":
+            parts.append(text[part_start:token.start()])
+            break
+    else:
+        # not closed
+        return None
+    args: dict[str, str] = {}
+    index = 0
+    # parts[0] is what follows the name before the first |
+    for part in parts[1:]:
+        key, equals, value = part.partition("=")
+        if equals:
+            args[key.strip()] = value.strip()
+        else:
+            index += 1
+            args[str(index)] = part.strip()
+    return args
+
+
+journal_dir = Path("cache/journal")
+
+
+class Journal:
+    """
+    Write-ahead log of the page saves and file uploads of one run, in cache/journal/<run id>.jsonl. Every item is
+    written as planned before any work is done on it and again with its outcome (saved, skipped or failed), keyed by
+    page title and a digest of what is written. When resuming, items whose latest outcome is saved or skipped with the
+    same digest are not looked at again.
+    """
+
+    def __init__(self, run_id: str, resume: bool = False):
+        self.path = journal_dir / f"{run_id}.jsonl"
+        # title -> digest of the items that were completed by the run being resumed
+        self.done: dict[str, str] = {}
+        if resume and self.path.exists():
+            self.load()
+        if len(self.done) == 0:
+            journal_dir.mkdir(parents=True, exist_ok=True)
+            self.path.unlink(missing_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.write(status="started", run=run_id)
+
+    def load(self):
+        for line in open(self.path, "r", encoding="utf-8"):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of a run that was killed while writing it
+                continue
+            if entry['status'] == "complete":
+                self.done.clear()
+                print(f"{self.path} is from a run that completed, starting a new run")
+                return
+            elif entry['status'] in ("saved", "skipped"):
+                self.done[entry['title']] = entry['digest']
+            elif entry['status'] in ("planned", "failed"):
+                self.done.pop(entry['title'], None)
+        print(f"Resuming {self.path}: {len(self.done)} items already done")
+
+    def write(self, **entry):
+        # the edit scheduler reports outcomes from its own thread
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def is_done(self, title: str, digest: str) -> bool:
+        return self.done.get(title, None) == digest
+
+    def record(self, action: str, title: str, digest: str, status: str, error: str | None = None):
+        entry = {"action": action, "title": title, "digest": digest, "status": status}
+        if error is not None:
+            entry['error'] = error
+        self.write(**entry)
+
+    def close(self, complete: bool):
+        if complete:
+            self.write(status="complete")
+        self.file.close()
+
+
+current_journal: Journal | None = None
+
+
+@contextmanager
+def journaled_run(name: str):
+    """
+    Journal the page saves and file uploads made by save_page, save_pages and the scripts that call journal_record.
+    The run id is name unless --run-id ID is passed; with --resume, the items the last unfinished run with the same
+    id completed are skipped.
+    """
+    global current_journal
+    run_id = name
+    if "--run-id" in sys.argv:
+        run_id = sys.argv[sys.argv.index("--run-id") + 1]
+    current_journal = Journal(run_id, resume="--resume" in sys.argv)
+    complete = False
+    try:
+        yield current_journal
+        complete = True
+    finally:
+        # saves still queued report their outcome to the journal
+        edit_scheduler(s).drain()
+        current_journal.close(complete)
+        current_journal = None
+
+
+def journal_done(title: str, digest: str) -> bool:
+    return current_journal is not None and current_journal.is_done(title, digest)
+
+
+def journal_record(action: str, title: str, digest: str, status: str, error: str | None = None):
+    if current_journal is not None:
+        current_journal.record(action, title, digest, status, error)
+
+
+def file_digest(path: Path) -> str:
+    """Size and modification time, as files to upload can be too large to hash on every run."""
+    stat = path.stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
 def save_page(page: Page | str, text: str, summary: str = "update page page"):
     if isinstance(page, str):
         page = Page(s, page)
+    digest = text_hash(text)
+    if journal_done(page.title(), digest):
+        return
+    journal_record("save", page.title(), digest, "planned")
     if page.text.strip() == text.strip():
+        journal_record("save", page.title(), digest, "skipped")
+        return
+    future = edit_scheduler(s).submit(page, text, summary)
+    finish_save(page.title(), digest, future)
+    future.result()
+
+
+def finish_save(title: str, digest: str, future: Future):
+    """Journal the outcome of a save made by the edit scheduler, and remember the new revision."""
+    if future.exception() is not None:
+        journal_record("save", title, digest, "failed", str(future.exception()))
         return
-    page.text = text
-    page.save(summary=summary)
+    journal_record("save", title, digest, "saved")
+    record_revision(future.result(), digest)
+
+
+@dataclass
+class PageEdit:
+    title: str
+    text: str
+    summary: str = "update page page"
+
 
+@dataclass
+class SaveReport:
+    unchanged: int = 0
+    created: int = 0
+    edited: int = 0
+    # done by the run that was resumed
+    resumed: int = 0
+
+    def __str__(self):
+        result = f"{self.unchanged} unchanged, {self.created} created, {self.edited} edited"
+        if self.resumed > 0:
+            result += f", {self.resumed} already done"
+        return result
+
+
+# revision ids of an offline wiki have nothing to do with the real ones, so it keeps its own cache
+revision_cache_path = Path(os.environ["BA_OFFLINE_WIKI"], "revisions.json") if offline \
+    else Path("cache/revisions.json")
+# page title -> [revision id, hash of the stripped text] of the revision the bot last read or saved
+revision_cache: dict[str, list] = {}
+# the entries recorded by this process, which write_revision_cache merges into the entries other processes wrote
+revision_updates: dict[str, list] = {}
+
+
+def text_hash(text: str) -> str:
+    return xxh3_64_hexdigest(text.strip())
+
+
+def load_revision_cache() -> dict[str, list]:
+    if len(revision_cache) == 0 and revision_cache_path.exists():
+        revision_cache.update(json.load(open(revision_cache_path, "r", encoding="utf-8")))
+    return revision_cache
+
+
+def record_revision(page: Page, digest: str | None = None):
+    """
+    Remember the current revision of a page that has just been read, or just been saved with text whose text_hash is
+    digest. pywikibot drops the text of a page it saved, so it is not read again.
+    """
+    if digest is not None:
+        entry = [page.latest_revision_id, digest]
+    elif page.exists():
+        entry = [page.latest_revision_id, text_hash(page.text)]
+    else:
+        return
+    load_revision_cache()[page.title()] = entry
+    revision_updates[page.title()] = entry
+
+
+def write_revision_cache():
+    revision_cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with file_lock(revision_cache_path.with_suffix(".lock")):
+        # other generators may have written the file since this one read it
+        merged = json.load(open(revision_cache_path, "r", encoding="utf-8")) if revision_cache_path.exists() else {}
+        updates = dict(revision_updates)
+        merged.update(updates)
+        tmp = revision_cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False)
+        tmp.replace(revision_cache_path)
+    # written now, unless recorded again in the meantime
+    for title, entry in updates.items():
+        if revision_updates.get(title) is entry:
+            del revision_updates[title]
+
+
+def flush_revision_cache():
+    """Write what save_page and other single saves recorded; batch saves write the cache themselves."""
+    if len(revision_updates) > 0:
+        write_revision_cache()
+
+
+# registered before the edit scheduler's exit hook, so it runs after the queued saves are done
+atexit.register(flush_revision_cache)
+
+
+def find_unchanged_pages(pages: list[Page], texts: list[str], batch_size: int | None = None) -> set[str]:
+    """
+    Titles of the pages that already hold the given text according to the revision cache. Only the latest revision
+    ids are queried, so the text of these pages is never downloaded.
+    """
+    cache = load_revision_cache()
+    candidates = [page for page, text in zip(pages, texts)
+                  if page.title() in cache and cache[page.title()][1] == text_hash(text)]
+    result: set[str] = set()
+    for page in s.preloadpages(candidates, groupsize=batch_size, content=False):
+        if page.exists() and page.latest_revision_id == cache[page.title()][0]:
+            result.add(page.title())
+    return result
+
+
+def save_pages(edits: Iterable[PageEdit], batch_size: int | None = None) -> SaveReport:
+    """
+    Save many pages like save_page does, but fetch their current text in batches of batch_size (the API limit by
+    default) first, so that only pages that actually change cost a request of their own. Pages that the revision
+    cache shows to be up-to-date are not downloaded at all, nor are pages saved or skipped by a resumed run.
+    """
+    # preloadpages only fills in the first of several pages with the same title, and the last edit would win anyway
+    latest: dict[str, PageEdit] = {}
+    for edit in edits:
+        title = Page(s, edit.title).title()
+        latest.pop(title, None)
+        latest[title] = edit
+    report = SaveReport()
+    digests = {title: text_hash(edit.text) for title, edit in latest.items()}
+    for title in [title for title in latest if journal_done(title, digests[title])]:
+        del latest[title]
+        report.resumed += 1
+    for title in latest:
+        journal_record("save", title, digests[title], "planned")
+    pages = [Page(s, title) for title in latest]
+    unchanged = find_unchanged_pages(pages, [edit.text for edit in latest.values()], batch_size)
+    report.unchanged += len(unchanged)
+    for title in unchanged:
+        journal_record("save", title, digests[title], "skipped")
+    remaining = [(page, edit) for page, edit in zip(pages, latest.values()) if page.title() not in unchanged]
+    for _ in s.preloadpages([page for page, _ in remaining], groupsize=batch_size):
+        pass
+    scheduler = edit_scheduler(s)
+    saves: list[Future] = []
+    try:
+        for page, edit in remaining:
+            title = page.title()
+            record_revision(page)
+            if page.text.strip() == edit.text.strip():
+                report.unchanged += 1
+                journal_record("save", title, digests[title], "skipped")
+                continue
+            if page.exists():
+                report.edited += 1
+                priority = EditPriority.UPDATE
+            else:
+                report.created += 1
+                priority = EditPriority.CREATE
+            future = scheduler.submit(page, edit.text, edit.summary, priority=priority)
+            future.add_done_callback(partial(finish_save, title, digests[title]))
+            saves.append(future)
+        scheduler.drain()
+    finally:
+        write_revision_cache()
+    print(f"Saved pages: {report}")
+    failures = [future.exception() for future in saves if future.exception() is not None]
+    if len(failures) > 0:
+        # the other pages are saved, and the journal lets a resumed run retry these
+        raise failures[0]
+    return report
 
 if __name__ == "__main__":
     raise NotImplementedError("Do not run this script directly.")
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+The wiki backend used by the bot: pywikibot by default, or the offline stand-in from offline_wiki.py when
+--offline-wiki DIR is passed or BA_OFFLINE_WIKI is set. Modules import Site, Page, FilePage, PreloadingGenerator and
+GeneratorFactory from here instead of from pywikibot, and use scan_categories to read whole categories.
+"""
+import asyncio
+import os
+import re
+import sys
+from collections.abc import Iterator
+from functools import cache
+from itertools import batched
+
+if "--offline-wiki" in sys.argv:
+    index = sys.argv.index("--offline-wiki")
+    # set in the environment so that worker processes use the same backend
+    os.environ["BA_OFFLINE_WIKI"] = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+
+offline = os.environ.get("BA_OFFLINE_WIKI", "") != ""
+
+if offline:
+    from offline_wiki import Page, FilePage, PreloadingGenerator, GeneratorFactory, get_site as Site
+else:
+    from pywikibot import Page, FilePage, Site
+    from pywikibot.pagegenerators import PreloadingGenerator, GeneratorFactory
+
+__all__ = ["offline", "Site", "Page", "FilePage", "PreloadingGenerator", "GeneratorFactory", "scan_categories",
+           "category_revisions", "fetch_lead_sections"]
+
+# how many API requests a category scan keeps waiting for at the same time
+in_flight_limit = int(os.environ.get("BA_WIKI_IN_FLIGHT", "4"))
+# pages per content request
+scan_groupsize = 50
+# subcategories, which category scans leave out
+category_namespace = 14
+
+
+def list_category_members(site, category: str, namespaces: list[int] | None,
+                          token: str | None) -> tuple[list[str], str | None]:
+    """One categorymembers request. Returns the titles and the token to continue with, None after the last one."""
+    if offline:
+        titles = site.category_members(category)
+        titles = [t for t in titles if Page(site, t).namespace != category_namespace]
+        if namespaces is not None:
+            titles = [t for t in titles if Page(site, t).namespace in namespaces]
+        return titles, None
+    from pywikibot.data.api import Request
+    # like -cat: in pywikibot, which lists the articles and files of a category but not its subcategories
+    parameters = {"action": "query", "list": "categorymembers", "cmtitle": f"Category:{category}",
+                  "cmprop": "title", "cmtype": "page|file", "cmlimit": "max"}
+    if namespaces is not None:
+        parameters['cmnamespace'] = "|".join(str(ns) for ns in namespaces)
+    if token is not None:
+        parameters['cmcontinue'] = token
+    data = Request(site=site, parameters=parameters).submit()
+    titles = [member['title'] for member in data['query']['categorymembers']]
+    return titles, data.get('continue', {}).get('cmcontinue', None)
+
+
+@cache
+def use_connection_pool(size: int):
+    """Let pywikibot's shared HTTP session keep a connection open for every request in flight."""
+    if offline:
+        return
+    from pywikibot.comms import http
+    from requests.adapters import HTTPAdapter
+    http.session.mount("https://", HTTPAdapter(pool_connections=size, pool_maxsize=size))
+
+
+async def scan(site, categories: list[str], namespaces: list[int] | None, exclude: re.Pattern | None,
+               content: bool, limit: int) -> list:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def call(function, *args):
+        async with semaphore:
+            return await asyncio.to_thread(function, *args)
+
+    def preload(pages: list) -> list:
+        return list(site.preloadpages(pages, groupsize=len(pages)))
+
+    claimed: set[str] = set()
+    content_batches: list[asyncio.Task] = []
+
+    async def list_category(category: str) -> list[str]:
+        # the next continuation depends on the previous response, but the contents of the titles in a response are
+        # requested while the next one is awaited
+        result = []
+        token = None
+        while True:
+            titles, token = await call(list_category_members, site, category, namespaces, token)
+            titles = [t for t in titles if exclude is None or exclude.search(t) is None]
+            result.extend(titles)
+            new_titles = [t for t in titles if t not in claimed]
+            claimed.update(new_titles)
+            if content:
+                for batch in batched(new_titles, scan_groupsize):
+                    content_batches.append(asyncio.create_task(call(preload, [Page(site, t) for t in batch])))
+            if token is None:
+                return result
+
+    listings = await asyncio.gather(*(list_category(category) for category in categories))
+    # the same order as a sequential scan of one category after the other
+    ordered = list(dict.fromkeys(title for titles in listings for title in titles))
+    if not content:
+        return [Page(site, title) for title in ordered]
+    loaded = {page.title(): page for batch in await asyncio.gather(*content_batches) for page in batch}
+    return [loaded[title] for title in ordered if title in loaded]
+
+
+def scan_categories(categories: list[str], namespaces: list[int] | None = None, exclude: str | None = None,
+                    content: bool = True, site=None, limit: int | None = None) -> Iterator:
+    """
+    The pages in any of the categories, like GeneratorFactory with -cat, -ns and -titleregexnot arguments would give
+    them, with their text preloaded if content is True. Category listings and content batches are requested
+    concurrently, up to limit (BA_WIKI_IN_FLIGHT, 4 by default) at a time. Nothing is requested before the first page
+    is taken from the iterator, and then the whole scan finishes before the first page is returned: pages are not
+    streamed, so that they come in the order of a sequential scan.
+    """
+    site = site if site is not None else Site()
+    limit = limit if limit is not None else in_flight_limit
+    use_connection_pool(max(limit, 10))
+    pattern = re.compile(exclude) if exclude is not None else None
+    yield from asyncio.run(scan(site, categories, namespaces, pattern, content, limit))
+
+
+def category_revisions(category: str, site=None) -> dict[str, int]:
+    """Title -> latest revision id of the pages in a category, not its subcategories, without downloading their text."""
+    site = site if site is not None else Site()
+    if offline:
+        pages = [Page(site, title) for title in site.category_members(category)]
+        pages = [p for p in pages if p.namespace != category_namespace]
+        return dict((p.title(), p.latest_revision_id) for p in site.preloadpages(pages, content=False))
+    from pywikibot.data.api import Request
+    result: dict[str, int] = {}
+    continuation: dict[str, str] = {}
+    while True:
+        parameters = {"action": "query", "generator": "categorymembers", "gcmtitle": f"Category:{category}",
+                      "gcmtype": "page|file", "gcmlimit": "max", "prop": "info"} | continuation
+        data = Request(site=site, parameters=parameters).submit()
+        for page in data.get('query', {}).get('pages', {}).values():
+            result[page['title']] = page['lastrevid']
+        if "continue" not in data:
+            return result
+        continuation = data['continue']
+
+
+def fetch_lead_batch(site, titles: list[str]) -> dict[str, tuple[int, str]]:
+    if offline:
+        return site.lead_sections(titles)
+    from pywikibot.data.api import Request
+    result: dict[str, tuple[int, str]] = {}
+    continuation: dict[str, str] = {}
+    while True:
+        parameters = {"action": "query", "prop": "revisions", "rvprop": "ids|content", "rvslots": "main",
+                      "rvsection": "0", "titles": "|".join(titles), "formatversion": "2"} | continuation
+        data = Request(site=site, parameters=parameters).submit()
+        for page in data['query']['pages']:
+            if "revisions" in page:
+                revision = page['revisions'][0]
+                result[page['title']] = (revision['revid'], revision['slots']['main']['content'])
+        if "continue" not in data:
+            return result
+        continuation = data['continue']
+
+
+def fetch_lead_sections(titles: list[str], site=None, limit: int | None = None) -> dict[str, tuple[int, str]]:
+    """
+    Title -> (latest revision id, text before the first heading) of the pages that exist, requested in batches of
+    scan_groupsize with up to limit requests in flight. Infoboxes are in the lead section, so this is all a scan of
+    infobox fields has to download.
+    """
+    site = site if site is not None else Site()
+    limit = limit if limit is not None else in_flight_limit
+
+    async def fetch_all() -> list[dict[str, tuple[int, str]]]:
+        semaphore = asyncio.Semaphore(limit)
+
+        async def fetch(batch: list[str]):
+            async with semaphore:
+                return await asyncio.to_thread(fetch_lead_batch, site, batch)
+
+        return await asyncio.gather(*(fetch(list(batch)) for batch in batched(titles, scan_groupsize)))
+
+    result: dict[str, tuple[int, str]] = {}
+    for batch_result in asyncio.run(fetch_all()):
+        result.update(batch_result)
+    return result